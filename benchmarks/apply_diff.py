@@ -0,0 +1,56 @@
+######################################################################################################################
+# Microbenchmark of the rain differential image application on Cityscapes sized frames (1024x512)
+# Usage:
+#       python benchmarks/apply_diff.py [--frames N] [--repeat N]
+######################################################################################################################
+# Halder, S. S., Lalonde, J. F., & de Charette, R. (2019).
+# Physics-Based Rendering for Improving Robustness to Rain. IEEE/CVF International Conference on Computer Vision
+#
+# From: Computer Vision Group, RITS team, Inria
+# License: MIT
+######################################################################################################################
+
+import os
+import sys
+import timeit
+from argparse import ArgumentParser
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from kernels import DiffKernel, diff_reference
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument("--frames", type=int, default=16, help="Number of random frames per run")
+    parser.add_argument("--repeat", type=int, default=5, help="Number of runs, the best one is reported")
+    parser.add_argument("--width", type=int, default=1024)
+    parser.add_argument("--height", type=int, default=512)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    shape = (args.height, args.width, 3)
+    clear_images = [rng.integers(0, 256, shape, dtype=np.uint8) for _ in range(args.frames)]
+    diff_images = [rng.integers(0, 511, shape, dtype=np.uint16) for _ in range(args.frames)]
+
+    saturate_kernel = DiffKernel()
+    wrap_kernel = DiffKernel(wrap=True)
+    candidates = [("original (uint16/int16, wrap)", diff_reference),
+                  ("DiffKernel (saturate)", saturate_kernel),
+                  ("DiffKernel (wrap)", wrap_kernel)]
+
+    print("{} frames of {}x{}".format(args.frames, args.width, args.height))
+    baseline = None
+    for name, kernel in candidates:
+        def run():
+            for clear_image, diff_image in zip(clear_images, diff_images):
+                kernel(clear_image, diff_image)
+
+        seconds = min(timeit.repeat(run, number=1, repeat=args.repeat)) / args.frames
+        baseline = baseline or seconds
+        print("  {:<30} {:7.3f} ms/frame  x{:.2f}".format(name, seconds * 1000, baseline / seconds))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,189 @@
+######################################################################################################################
+# End-to-end benchmark of the Dataset stages (download, extract, apply_diff, rain, fog) on synthetic data served
+# by a local HTTP server. Reports wall time, images/s, MB/s and peak RSS per stage as JSON. The peak RSS of the pool
+# workers can't be reset between stages, peak_rss_children_cumulative_mb is the largest one since the start of the run.
+# Usage:
+#       python benchmarks/run.py [kitti|cityscapes] [--images N] [--workers N] [--format png|webp|npy]
+#                                [--png_compression 0-9] [--writer_threads N] [--batch_size N] [--json %FILE%]
+#
+# Example, comparing worker counts:
+#       python benchmarks/run.py cityscapes --images 64 --workers 1 --json w1.json
+#       python benchmarks/run.py cityscapes --images 64 --workers 8 --json w8.json
+######################################################################################################################
+# Halder, S. S., Lalonde, J. F., & de Charette, R. (2019).
+# Physics-Based Rendering for Improving Robustness to Rain. IEEE/CVF International Conference on Computer Vision
+#
+# From: Computer Vision Group, RITS team, Inria
+# License: MIT
+######################################################################################################################
+
+import os
+import glob
+import json
+import time
+import shutil
+import resource
+import platform
+import tempfile
+import subprocess
+from argparse import ArgumentParser
+
+import cv2
+
+import synthetic
+from server import Server
+
+
+def _peak_rss_mb():
+    # Peak RSS of this process since the last reset, and of the largest child (pool workers) terminated so far
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    peak = int(line.split()[1]) / 1024.
+    except OSError:
+        pass
+    return peak, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024.
+
+
+def _reset_peak_rss():
+    # Linux only, elsewhere the peak is the one of the whole run
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+def _size(paths):
+    return sum(os.path.getsize(path) for path in paths)
+
+
+class Stages:
+    def __init__(self):
+        self.results = {}
+
+    def run(self, name, func):
+        # func returns (images, bytes) processed
+        _reset_peak_rss()
+        start = time.perf_counter()
+        images, processed_bytes = func()
+        wall = time.perf_counter() - start
+        peak, peak_children = _peak_rss_mb()
+        self.results[name] = {"wall_s": round(wall, 4),
+                              "images": images,
+                              "images_per_s": round(images / wall, 2) if images else None,
+                              "mb": round(processed_bytes / 1e6, 2),
+                              "mb_per_s": round(processed_bytes / 1e6 / wall, 2) if processed_bytes else None,
+                              "peak_rss_mb": round(peak, 1),
+                              "peak_rss_children_cumulative_mb": round(peak_children, 1)}
+        print("[{}] {}".format(name, json.dumps(self.results[name])))
+
+
+def _commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument("dataset", choices=sorted(synthetic.DATASETS))
+    parser.add_argument("--images", type=int, default=16, help="Number of original images")
+    parser.add_argument("--width", type=int, help="Width of the original images, default to the dataset one")
+    parser.add_argument("--height", type=int, help="Height of the original images, default to the dataset one")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--format", type=str, default="png")
+    parser.add_argument("--png_compression", type=int)
+    parser.add_argument("--writer_threads", type=int, default=0)
+    parser.add_argument("--batch_size", type=int, default=1)
+    parser.add_argument("--work_dir", type=str, help="Directory for the synthetic data, a temporary one by default")
+    parser.add_argument("--keep", action="store_true", help="Don't remove the work directory")
+    parser.add_argument("--json", type=str, help="Write the results to this file")
+    args = parser.parse_args()
+
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix="weather_benchmark_")
+    dataset_class, sequence, _ = synthetic.DATASETS[args.dataset]
+    resolution = (args.width, args.height) if args.width and args.height else None
+    stages = Stages()
+
+    paths = {}
+
+    def setup():
+        paths["original"], paths["server"] = synthetic.build(args.dataset, work_dir, args.images, resolution)
+        return args.images, _size(glob.glob(os.path.join(work_dir, "**/*.*"), recursive=True))
+
+    stages.run("setup", setup)
+
+    with Server(paths["server"]) as server:
+        dataset = dataset_class(paths["original"], os.path.join(work_dir, "output"), [sequence],
+                                workers=args.workers, http_path=server.url, force=True, output_format=args.format,
+                                png_compression=args.png_compression, writer_threads=args.writer_threads,
+                                batch_size=args.batch_size)
+        os.makedirs(dataset.downloaded_directory, exist_ok=True)
+        os.makedirs(dataset.datasets_directory, exist_ok=True)
+
+        def download():
+            dataset._download_checksums()
+            paths["archives"] = list(dataset._download_manager().download_all(dataset.links))
+            return 0, _size(paths["archives"])
+
+        stages.run("download", download)
+
+    def extract():
+        for archive in paths["archives"]:
+            dataset._extract(archive, dataset.datasets_directory)
+        files = [path for path in glob.glob(os.path.join(dataset.datasets_directory, "**/*"), recursive=True) if os.path.isfile(path)]
+        return len(files), _size(files)
+
+    stages.run("extract", extract)
+
+    sequence_dir = os.path.join(dataset.datasets_directory, dataset.name, sequence)
+    diff_files = sorted(glob.glob(os.path.join(sequence_dir, "rain_diff", "*", "rainy_image", "**/*.png"), recursive=True))
+    if diff_files:
+        def apply_diff():
+            # Single process, one decoded original per diff
+            output_file = dataset.encoding.path(os.path.join(work_dir, "apply_diff.png"))
+            for diff_file in diff_files:
+                relative_path = os.path.relpath(diff_file, sequence_dir).split(os.sep, 3)[3]
+                clear_image = dataset._load_original(os.path.join(paths["original"], sequence, relative_path))
+                written = dataset._apply_diff(clear_image, diff_file, output_file)
+                if written is not None:
+                    written.result()
+            return len(diff_files), _size(diff_files)
+
+        stages.run("apply_diff", apply_diff)
+
+    def generate(weather, output):
+        def func():
+            dataset.generate([weather])
+            files = glob.glob(os.path.join(sequence_dir, output, "**/*." + args.format), recursive=True)
+            return len(files), _size(files)
+        return func
+
+    if diff_files:
+        stages.run("rain", generate("rain", os.path.join("rain", "*", "rainy_image")))
+    stages.run("fog", generate("fog", "fog"))
+
+    report = {"commit": _commit(),
+              "python": platform.python_version(),
+              "opencv": cv2.__version__,
+              "cpus": os.cpu_count(),
+              "config": {"dataset": args.dataset, "images": args.images, "resolution": resolution, "workers": args.workers,
+                         "format": args.format, "png_compression": args.png_compression, "writer_threads": args.writer_threads, "batch_size": args.batch_size},
+              "stages": stages.results}
+
+    print(json.dumps(report, indent=2))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if not args.keep and not args.work_dir:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
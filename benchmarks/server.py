@@ -0,0 +1,95 @@
+######################################################################################################################
+# Local stand-in for Dataset.HTTP_PATH, serving a directory with support for single byte-range requests
+# Usage:
+#       python benchmarks/server.py %DIRECTORY% [--port N]
+######################################################################################################################
+# Halder, S. S., Lalonde, J. F., & de Charette, R. (2019).
+# Physics-Based Rendering for Improving Robustness to Rain. IEEE/CVF International Conference on Computer Vision
+#
+# From: Computer Vision Group, RITS team, Inria
+# License: MIT
+######################################################################################################################
+
+import os
+import re
+import threading
+from argparse import ArgumentParser
+from functools import partial
+from http import HTTPStatus
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+
+class RangeRequestHandler(SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def send_head(self):
+        match = re.fullmatch(r"bytes=(\d*)-(\d*)", self.headers.get("Range", ""))
+        path = self.translate_path(self.path)
+        if match is None or not os.path.isfile(path):
+            self._range = None
+            return super().send_head()
+
+        size = os.path.getsize(path)
+        start, end = match.groups()
+        if start:
+            start, end = int(start), min(int(end), size - 1) if end else size - 1
+        else:
+            start, end = max(0, size - int(end)), size - 1
+        if start > end:
+            self.send_error(HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE)
+            return None
+
+        f = open(path, "rb")
+        f.seek(start)
+        self._range = end - start + 1
+        self.send_response(HTTPStatus.PARTIAL_CONTENT)
+        self.send_header("Content-Type", self.guess_type(path))
+        self.send_header("Content-Range", "bytes {}-{}/{}".format(start, end, size))
+        self.send_header("Content-Length", str(self._range))
+        self.send_header("Accept-Ranges", "bytes")
+        self.end_headers()
+        return f
+
+    def copyfile(self, source, outputfile):
+        if self._range is None:
+            return super().copyfile(source, outputfile)
+        remaining = self._range
+        while remaining:
+            block = source.read(min(remaining, 1 << 20))
+            if not block:
+                break
+            outputfile.write(block)
+            remaining -= len(block)
+
+
+class Server:
+    """Serves directory on 127.0.0.1 from a background thread, use as a context manager."""
+
+    def __init__(self, directory, port=0):
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", port), partial(RangeRequestHandler, directory=directory))
+        self.url = "http://127.0.0.1:{}/".format(self.httpd.server_address[1])
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument("directory", type=str)
+    parser.add_argument("--port", type=int, default=8000)
+    args = parser.parse_args()
+
+    with Server(args.directory, args.port) as server:
+        print("Serving {} on {}".format(args.directory, server.url))
+        threading.Event().wait()
+
+
+if __name__ == '__main__':
+    main()
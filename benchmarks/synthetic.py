@@ -0,0 +1,113 @@
+######################################################################################################################
+# Builds a synthetic Kitti/Cityscapes-shaped tree for the benchmarks: original images, and the weather archives
+# (depth, fog transmittance, rain or rain diff) with their checksums file, laid out as under Dataset.HTTP_PATH
+# Usage:
+#       python benchmarks/synthetic.py [kitti|cityscapes] --output_dir %PATH% [--images N] [--width W --height H]
+######################################################################################################################
+# Halder, S. S., Lalonde, J. F., & de Charette, R. (2019).
+# Physics-Based Rendering for Improving Robustness to Rain. IEEE/CVF International Conference on Computer Vision
+#
+# From: Computer Vision Group, RITS team, Inria
+# License: MIT
+######################################################################################################################
+
+import os
+import sys
+import hashlib
+from argparse import ArgumentParser
+from zipfile import ZipFile, ZIP_STORED
+
+import numpy as np
+import cv2
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from kitti import Kitti
+from cityscapes import Cityscapes
+
+DATASETS = {"kitti": (Kitti, "data_object/training/image_2", (1242, 375)),
+            "cityscapes": (Cityscapes, "leftImg8bit/train", (2048, 1024))}
+
+
+def _image(rng, shape, dtype=np.uint8, high=256):
+    # Smooth gradient plus noise, compresses roughly like a real frame
+    y, x = np.mgrid[0:shape[0], 0:shape[1]]
+    base = (x * 255 // max(1, shape[1] - 1) + y * 255 // max(1, shape[0] - 1)) // 2
+    if len(shape) == 3:
+        base = base[..., None]
+    return np.clip(base + rng.integers(-24, 25, shape), 0, high - 1).astype(dtype)
+
+
+def relative_paths(dataset_name, images):
+    # Cityscapes originals are grouped by city, Kitti ones are flat
+    if dataset_name == "cityscapes":
+        return ["city{}/city{}_{:06d}_leftImg8bit.png".format(i % 4, i % 4, i) for i in range(images)]
+    return ["{:06d}.png".format(i) for i in range(images)]
+
+
+def build(dataset_name, output_dir, images=16, resolution=None, levels=("30m", "75m"), rain_levels=("25mm", "50mm"), seed=0):
+    """Write originals under <output_dir>/original and archives under <output_dir>/server, return both paths."""
+    dataset_class, sequence, default_resolution = DATASETS[dataset_name]
+    width, height = resolution or default_resolution
+    rng = np.random.default_rng(seed)
+
+    original_dir = os.path.join(output_dir, "original")
+    server_dir = os.path.join(output_dir, "server")
+    os.makedirs(server_dir, exist_ok=True)
+
+    paths = relative_paths(dataset_name, images)
+    weather_shape = None
+    for relative_path in paths:
+        original_file_path = os.path.join(original_dir, sequence, relative_path)
+        os.makedirs(os.path.dirname(original_file_path), exist_ok=True)
+        img = _image(rng, (height, width, 3))
+        cv2.imwrite(original_file_path, img)
+        weather_shape = dataset_class.transform_original_image(None, img).shape  # Transforms don't use the instance
+
+    name = "weather_" + dataset_name
+    sequence_data = dataset_class.data[sequence] if sequence in dataset_class.data else dataset_class.data["*"]
+    checksums = []
+    for data in sequence_data:
+        archive = os.path.join(server_dir, "{}_{}_{}.zip".format(name, sequence.replace("/", "_"), data))
+        with ZipFile(archive, "w", ZIP_STORED) as zip_file:
+            prefix = "/".join([name, sequence, data])
+            for relative_path in paths:
+                if data == "depth":
+                    members = {"/".join([prefix, relative_path]): _image(rng, weather_shape[:2], np.uint16, 1 << 16)}
+                elif data == "fog_transmittance":
+                    members = {"/".join([prefix, level, relative_path]): _image(rng, weather_shape) for level in levels}
+                elif data == "rain":
+                    members = {"/".join([prefix, level, "rainy_image", relative_path]): _image(rng, weather_shape) for level in rain_levels}
+                else:
+                    # Rain diff, stored with an offset of 255 over 16 bits, and its mask
+                    members = {}
+                    for level in rain_levels:
+                        members["/".join([prefix, level, "rainy_image", relative_path])] = _image(rng, weather_shape, np.uint16, 511)
+                        members["/".join([prefix, level, "rain_mask", relative_path])] = _image(rng, weather_shape[:2])
+                for member, img in members.items():
+                    zip_file.writestr(member, cv2.imencode(".png", img)[1].tobytes())
+
+        with open(archive, "rb") as f:
+            checksums.append("{}  {}".format(hashlib.sha256(f.read()).hexdigest(), os.path.basename(archive)))
+
+    with open(os.path.join(server_dir, "{}_checksums.txt".format(name)), "w") as f:
+        f.write("\n".join(checksums) + "\n")
+
+    return original_dir, server_dir
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument("dataset", choices=sorted(DATASETS))
+    parser.add_argument("--output_dir", type=str, required=True)
+    parser.add_argument("--images", type=int, default=16)
+    parser.add_argument("--width", type=int, help="Width of the original images, default to the dataset one")
+    parser.add_argument("--height", type=int, help="Height of the original images, default to the dataset one")
+    args = parser.parse_args()
+
+    resolution = (args.width, args.height) if args.width and args.height else None
+    original_dir, server_dir = build(args.dataset, args.output_dir, args.images, resolution)
+    print("Originals: {}\nArchives: {}".format(original_dir, server_dir))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+######################################################################################################################
+# Halder, S. S., Lalonde, J. F., & de Charette, R. (2019).
+# Physics-Based Rendering for Improving Robustness to Rain. IEEE/CVF International Conference on Computer Vision
+#
+# From: Computer Vision Group, RITS team, Inria
+# License: MIT
+######################################################################################################################
+
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+class LRUCache:
+    """Bounded least recently used cache, counting hits and misses.
+
+    on_evict(key, value) is called for every entry dropped by the cache, e.g. to close a file handle.
+    Thread safe, values are loaded outside of the lock so that threads missing different keys load them in parallel.
+    """
+
+    def __init__(self, maxsize=32, on_evict=None):
+        self.maxsize = maxsize
+        self.on_evict = on_evict
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, load):
+        # Return the cached value for key, calling load(key) on a miss
+        with self._lock:
+            if key in self._entries:
+                self.hits += 1
+                self._entries.move_to_end(key)
+                return self._entries[key]
+            self.misses += 1
+
+        value = load(key)
+        if self.maxsize <= 0:
+            return value
+
+        evicted = []
+        with self._lock:
+            if key in self._entries:
+                # Loaded meanwhile by another thread, keep a single value
+                evicted.append((key, value))
+                value = self._entries[key]
+            else:
+                self._entries[key] = value
+                if len(self._entries) > self.maxsize:
+                    evicted.append(self._entries.popitem(last=False))
+        for entry in evicted:
+            self._evict(*entry)
+        return value
+
+    def pop(self, key):
+        # Drop the entry of key, if any
+        with self._lock:
+            entry = (key, self._entries.pop(key)) if key in self._entries else None
+        if entry is not None:
+            self._evict(*entry)
+
+    def _evict(self, key, value):
+        if self.on_evict is not None:
+            self.on_evict(key, value)
+
+
+class ArrayStore:
+    """Arrays computed from source files, e.g. transformed original images, saved as .npy under a directory
+    mirroring the sources one.
+
+    An entry is set to the mtime of its source when written, and is valid while both mtimes match.
+    """
+
+    def __init__(self, directory, source_root):
+        self.directory = directory
+        self.source_root = source_root
+        self.hits = 0
+        self.misses = 0
+
+    def path(self, source):
+        return os.path.join(self.directory, os.path.relpath(source, self.source_root) + ".npy")
+
+    def get(self, source, load):
+        # Return the stored array for source, calling load(source) and storing its result if stale or missing
+        path = self.path(source)
+        st = os.stat(source)
+        try:
+            if os.stat(path).st_mtime_ns == st.st_mtime_ns:
+                value = np.load(path)
+                self.hits += 1
+                return value
+        except (OSError, ValueError):
+            pass  # Missing, or truncated by an interrupted run
+
+        self.misses += 1
+        value = load(source)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = "{}.{}-{}.tmp".format(path, os.getpid(), threading.get_ident())
+        with open(tmp, "wb") as f:
+            np.save(f, value)
+        os.utime(tmp, ns=(st.st_atime_ns, st.st_mtime_ns))
+        os.replace(tmp, path)
+        return value
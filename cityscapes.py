@@ -15,12 +15,16 @@ from dataset import Dataset
 class Cityscapes(Dataset):
     sequences = ['leftImg8bit/train', 'leftImg8bit/val']
     data = {"*": ["depth", "fog_transmittance", "rain_diff"], "leftImg8bit/val": ["rain_diff"]}
+    size = (1024, 512)
 
-    def __init__(self, original_dir, output_dir, sequences=None):
+    def __init__(self, original_dir, output_dir, sequences=None, **kwargs):
         if sequences is None:
             sequences = Cityscapes.sequences
 
-        super().__init__("cityscapes", original_dir, output_dir, sequences, Cityscapes.data)
+        super().__init__("cityscapes", original_dir, output_dir, sequences, Cityscapes.data, **kwargs)
 
     def transform_original_image(self, img):
-        return cv2.resize(img, (1024, 512), cv2.INTER_CUBIC)  # Downscale original image
+        return cv2.resize(img, Cityscapes.size, cv2.INTER_CUBIC)  # Downscale original image
+
+    def transform_params(self):
+        return {"size": Cityscapes.size}
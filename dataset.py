@@ -7,37 +7,105 @@
 ######################################################################################################################
 
 import os
-import urllib.request
-import hashlib
 import numpy as np
 import cv2
-import glob
 import shutil
+import multiprocessing
+import pickle
+import json
+import hashlib
 from tqdm import tqdm
 from zipfile import ZipFile
 
+from kernels import FogKernel, DiffKernel
+from encoding import OutputEncoding, WriterPool
+from shards import ShardWriter, SUFFIX as SHARDS_SUFFIX
+from weather_view import WeatherView
+from cache import LRUCache, ArrayStore
+from downloader import DownloadManager, ChecksumCache
+from extractor import Extractor, member_mtime_ns
+from file_index import FileIndex
+from instrumentation import NullMetrics
+from manifest import Manifest, make_record, make_shard_record
+
+
+# Dataset used by the current worker process, set once by the pool initializer
+_worker_dataset = None
+
+
+def _init_worker(pickled_dataset):
+    # Unpickled even when forked, so that caches and open archives of the parent are never shared
+    global _worker_dataset
+    _worker_dataset = pickle.loads(pickled_dataset)
+    cv2.setNumThreads(1)  # Parallelism comes from the pool, avoid oversubscribing cores
+
+
+class _ItemResult:
+    # Returned by the work item methods, merged by Dataset._run_items
+    def __init__(self):
+        self.missing = []  # Missing original files
+        self.records = []  # Manifest records of the generated outputs
+        self.metrics = None  # Metrics drained from a worker process
+
+    def merge(self, other):
+        self.missing.extend(other.missing)
+        self.records.extend(other.records)
+
+
+def _close_zip_file(archive, zip_file):
+    zip_file.close()
+
+
+def _run_worker_item(task):
+    method_name, item = task
+    result = getattr(_worker_dataset, method_name)(item)
+    result.metrics = _worker_dataset.metrics.drain()
+    return result
+
 
 class Dataset:
     HTTP_PATH = "https://www.rocq.inria.fr/rits_files/computer-vision/weather-augment/"
+    STREAMED_DATA = ("fog_transmittance", "rain_diff")
 
-    def __init__(self, name, original_dir, output_dir, sequences, data):
+    def __init__(self, name, original_dir, output_dir, sequences, data, workers=1, wrap_diff=False, cache_size=32,
+                 http_path=None, max_downloads=4, segments=4, verify=False, extract_threads=8,
+                 force=False, metrics=None, output_format="png", png_compression=None, writer_threads=0,
+                 shards=False, batch_size=1, store_originals=False, persist_index=False):
         self.original_name = name
         self.name = "weather_"+self.original_name
         self.original_dir = original_dir
         self.output_dir = output_dir
         self.sequences = sequences
         self.data = data
-        self.checksums_link = Dataset.HTTP_PATH + "{}_checksums.txt".format(self.name)
+        self.workers = workers
+        self.batch_size = max(1, batch_size)  # Originals per work item
+        self.metrics = metrics if metrics is not None else NullMetrics()
+        self.force = force  # Regenerate outputs even if the manifest says they are up to date
+        self._fog_kernel = FogKernel()
+        self._diff_kernel = DiffKernel(wrap=wrap_diff)
+        self._originals_cache = LRUCache(cache_size)  # Transformed originals shared by the WeatherViews of the dataset
+        self.encoding = OutputEncoding(output_format, png_compression)  # Format of the generated images
+        self._writer = WriterPool(writer_threads)
+        self._shards = ShardWriter() if shards else None  # Pack the outputs of each level instead of writing files
+        self._archives = LRUCache(8, on_evict=_close_zip_file)  # Open archives in streaming mode
+        self.http_path = (http_path or Dataset.HTTP_PATH).rstrip("/") + "/"
+        self.max_downloads = max_downloads
+        self.segments = segments
+        self.verify = verify  # Rehash pre-downloaded archives even if the checksum cache knows them
+        self.extract_threads = extract_threads
+        self.checksums = {}
+        self.checksums_link = self.http_path + "{}_checksums.txt".format(self.name)
         self.downloaded_directory = os.path.join(output_dir, "downloaded")
         self.datasets_directory = os.path.join(self.output_dir, "weather_datasets")
+        self._originals_store = self._transformed_originals_store() if store_originals else None
+        # Originals, transmittance, diff and mask files, listed once per generation
+        self._file_index = FileIndex(os.path.join(self.datasets_directory, self.name, "file_index.json") if persist_index else None)
 
         self.links = []
         for sequence in self.sequences:
             sequence_data = self.data[sequence] if sequence in self.data.keys() else self.data["*"]
-            sequence = sequence.replace("/", "_")
             print(sequence_data)
-            for d in sequence_data:
-                self.links.append(Dataset.HTTP_PATH + "{}_{}_{}.zip".format(self.name, sequence, d))
+            self.links.extend(self._sequence_links(sequence))
 
         print("Verifying {} integrity... {}".format(self.original_name, original_dir), end="")
         for sequence in self.sequences:
@@ -48,192 +116,502 @@ class Dataset:
         print(" [OK]")
 
 
-    def _extract(self, archive, directory_to_extract):
-        with ZipFile(file=archive) as zip_file:
-            for file in tqdm(iterable=zip_file.namelist(), total=len(zip_file.namelist()), desc="       Extracting: " + os.path.basename(archive)):
-                zip_file.extract(member=file, path=directory_to_extract)
+    def __getstate__(self):
+        # Sent to the worker processes. Caches, kernel buffers, listings, open files, locks and threads belong to the
+        # process which made them: only their settings are sent, and __setstate__ makes fresh ones
+        state = self.__dict__.copy()
+        state["_fog_kernel"] = self._fog_kernel.linf
+        state["_diff_kernel"] = self._diff_kernel.wrap
+        state["_originals_cache"] = self._originals_cache.maxsize
+        state["_archives"] = self._archives.maxsize
+        state["_writer"] = self._writer.threads
+        state["_shards"] = self._shards is not None
+        state["_file_index"] = (self._file_index.path, self._file_index.suffix)
+        state["metrics"] = type(self.metrics)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._fog_kernel = FogKernel(state["_fog_kernel"])
+        self._diff_kernel = DiffKernel(wrap=state["_diff_kernel"])
+        self._originals_cache = LRUCache(state["_originals_cache"])
+        self._archives = LRUCache(state["_archives"], on_evict=_close_zip_file)
+        self._writer = WriterPool(state["_writer"])
+        self._shards = ShardWriter() if state["_shards"] else None
+        self._file_index = FileIndex(*state["_file_index"])
+        self.metrics = state["metrics"]()
+
+    def _sequence_links(self, sequence):
+        sequence_data = self.data[sequence] if sequence in self.data.keys() else self.data["*"]
+        sequence = sequence.replace("/", "_")
+        return [self.http_path + "{}_{}_{}.zip".format(self.name, sequence, d) for d in sequence_data]
+
+    def _extract(self, archive, directory_to_extract, skip=None):
+        with self.metrics.time("extract"):
+            extracted, skipped = Extractor(archive, threads=self.extract_threads).extract(directory_to_extract, skip=skip, desc="       Extracting: " + os.path.basename(archive))
+        self.metrics.count("files_extracted", extracted)
+        self.metrics.count("files_already_extracted", skipped)
+        if skipped:
+            print("       {} files already extracted, skipped".format(skipped))
+
+    @staticmethod
+    def _is_streamed(member):
+        # Members read straight from the archive in streaming mode, instead of being extracted
+        return any("/{}/".format(data) in member for data in Dataset.STREAMED_DATA)
+
+    def _download_manager(self):
+        checksum_cache = ChecksumCache(os.path.join(self.downloaded_directory, ".sha256_cache.json"), verify=self.verify)
+        return DownloadManager(self.downloaded_directory, self.checksums, max_downloads=self.max_downloads,
+                               segments=self.segments, checksum_cache=checksum_cache)
+
+    def _download_checksums(self):
+        checksum_file_name = DownloadManager(self.downloaded_directory).download(self.checksums_link, overwrite=True)
 
-    class DownloadProgressBar(tqdm):
-        def update_to(self, b=1, bsize=1, tsize=None):
-            if tsize is not None:
-                self.total = tsize
-            self.update(b * bsize - self.n)
-
-    def _download_url(self, url, output_path):
-        with self.DownloadProgressBar(unit='B', unit_scale=True,
-                                 miniters=1, desc="     Downloading: " + url.split('/')[-1]) as t:
-            urllib.request.urlretrieve(url, filename=output_path, reporthook=t.update_to)
+        self.checksums = {}
+        with open(checksum_file_name, 'r') as f:
+            for line in f:
+                value, key = line.split()
+                self.checksums[key] = value
 
-    def _sha256sum(self, filename, blocksize=65536):
-        hash_sha256 = hashlib.sha256()
-        with tqdm(total=os.stat(filename).st_size, desc="       Calculating checksum: " + os.path.basename(filename), unit='B', unit_scale=True, unit_divisor=1024) as pbar:
-            with open(filename, "rb") as f:
-                block = 1
-                while block:
-                    block = f.read(blocksize)
-                    if block:
-                        pbar.update(len(block))
-                        hash_sha256.update(block)
+        return checksum_file_name
 
-        return hash_sha256.hexdigest()
+    def _remove_downloaded(self, checksum_file_name):
+        os.remove(checksum_file_name)
+        checksum_cache_file_name = os.path.join(self.downloaded_directory, ".sha256_cache.json")
+        if os.listdir(self.downloaded_directory) == [os.path.basename(checksum_cache_file_name)]:
+            os.remove(checksum_cache_file_name)
+        if len(os.listdir(self.downloaded_directory)) == 0:
+            os.rmdir(self.downloaded_directory)
 
     def download_and_extract_all(self, auto_remove=True):
         os.makedirs(self.downloaded_directory, exist_ok=True)
         os.makedirs(self.datasets_directory, exist_ok=True)
 
-        # Get Checksums
-        checksum_file_name = os.path.join(self.downloaded_directory, self.checksums_link.split('/')[-1])
-        self._download_url(self.checksums_link, checksum_file_name)
+        checksum_file_name = self._download_checksums()
 
-        self.checksums = {}
-        with open(checksum_file_name, 'r') as f:
-            for line in f:
-                value, key = line.split()
-                self.checksums[key] = value
+        # Archives are extracted as soon as they are downloaded, while the next ones are still downloading
+        for url_idx, path_to_download in enumerate(self._download_manager().download_all(self.links)):
+            print("     {}, extract [{}/{}]".format(self.name, url_idx + 1, len(self.links)))
+            self._extract(path_to_download, self.datasets_directory)
 
-        for url_idx, url in enumerate(self.links):
-            print("     {}, download [{}/{}]".format(self.name, url_idx + 1, len(self.links)))
-            self.download_and_extract(url, auto_remove)
+            if auto_remove:
+                os.remove(path_to_download)
 
         if auto_remove:
-            os.remove(checksum_file_name)
-            if len(os.listdir(self.downloaded_directory)) == 0:
-                os.rmdir(self.downloaded_directory)
+            self._remove_downloaded(checksum_file_name)
 
     def download_and_extract(self, url, auto_remove=True):
-        downloaded_file_name = url.split('/')[-1]
-        path_to_download = os.path.join(self.downloaded_directory, downloaded_file_name)
-
-        download_needed = True
-
-        # Redownload this file only if the checksum is invalid
-        if os.path.isfile(path_to_download):
-            sha256sum = self._sha256sum(path_to_download)
-            if downloaded_file_name in self.checksums and self.checksums[downloaded_file_name] == sha256sum:
-                print("\nUsing pre-downloaded file")
-                download_needed = False
-            else:
-                print("\nSha256sum is invalid: {}. Will re-download".format(downloaded_file_name))
-
-        if download_needed:
-            self._download_url(url, path_to_download)
+        path_to_download = self._download_manager().download(url)
 
         self._extract(path_to_download, self.datasets_directory)
         
         if auto_remove:
             os.remove(path_to_download)
 
+    def download_and_generate_all(self, weathers=("rain", "fog"), auto_remove=True):
+        # Streaming mode: fog transmittance and rain diff images are decoded straight from the downloaded archives,
+        # only the other members (depth, ...) are extracted. Archives are processed one sequence at a time.
+        os.makedirs(self.downloaded_directory, exist_ok=True)
+        os.makedirs(self.datasets_directory, exist_ok=True)
+
+        checksum_file_name = self._download_checksums()
+        download_manager = self._download_manager()
+
+        for seq_idx, sequence in enumerate(self.sequences):
+            print("     {}, Sequence [{}/{}], download".format(self.name, seq_idx + 1, len(self.sequences)))
+            archives = sorted(download_manager.download_all(self._sequence_links(sequence)))
+            for archive in archives:
+                self._extract(archive, self.datasets_directory, skip=self._is_streamed)
+
+            self.generate(weathers, sequences=[sequence], archives=archives)
+
+            if auto_remove:
+                for archive in archives:
+                    # Closed first, the disk space of an open file isn't freed
+                    self._close_archive(archive)
+                    os.remove(archive)
+
+        if auto_remove:
+            self._remove_downloaded(checksum_file_name)
+
     def transform_original_image(self, img):
         raise NotImplementedError
 
+    def transform_params(self):
+        # Parameters of transform_original_image, stored originals are recomputed when they change
+        return {}
+
+    def _transformed_originals_store(self):
+        # One directory per original dataset location and transform
+        key = json.dumps([os.path.abspath(self.original_dir), type(self).__name__, self.transform_params()], sort_keys=True)
+        directory = os.path.join(self.output_dir, "transformed_originals", self.name, hashlib.sha1(key.encode()).hexdigest()[:16])
+        return ArrayStore(directory, self.original_dir)
+
     def generate_fog(self):
-        for seq_idx, sequence in enumerate(self.sequences):
-            sequence_data = self.data[sequence] if sequence in self.data.keys() else self.data["*"]
-            if "fog_transmittance" not in sequence_data:
-                print(sequence+", No fog data in this sequence.")
+        self.generate(["fog"])
+
+    def generate_rain(self):
+        self.generate(["rain"])
+
+    def generate_rain_from_diff(self):
+        self.generate(["rain"])
+
+    def _rain_from_diff(self):
+        sequence_data = self.data["*"]
+        if "rain_diff" in sequence_data:
+            return True
+        elif "rain" in sequence_data:
+            return False  # Nothing to do
+        else:
+            raise NotImplementedError
+
+    def view(self, weather, level, **kwargs):
+        # Frames composited on access, without generating them, see WeatherView
+        return WeatherView(self, weather, level, **kwargs)
+
+    def generate(self, weathers=("rain", "fog"), sequences=None, archives=None):
+        # Every fog and rain variant of an original image is generated from a single decoded frame.
+        # With archives, fog transmittance and rain diff images are read from these zip files instead of the disk.
+        rain_from_diff = "rain" in weathers and self._rain_from_diff()
+        sequences = self.sequences if sequences is None else sequences
+
+        work = {}
+        for sequence in sequences:
+            if rain_from_diff:
+                self._collect_rain(sequence, work, archives)
+            if "fog" in weathers:
+                self._collect_fog(sequence, work, archives)
+
+        # Skip the outputs already generated from the same inputs and parameters
+        manifest = Manifest(self._manifest_path())
+        items = []
+        missing = []
+        up_to_date = 0
+        for key, variants in sorted(work.items()):
+            if not self._has_original(*key):
+                missing.append(os.path.join(self.original_dir, *key))
                 continue
+            fog_variants, rain_variants, skipped = self._stale_variants(manifest, *key, variants)
+            up_to_date += skipped
+            if fog_variants or rain_variants:
+                items.append(key + (fog_variants, rain_variants))
+        if up_to_date:
+            print("     {} outputs up to date, skipped".format(up_to_date))
+        self._file_index.save()
+
+        try:
+            batches = [items[i:i + self.batch_size] for i in range(0, len(items), self.batch_size)]
+            self._run_items("_generate_originals", batches, "        {}, {}".format(self.name, ", ".join(w.capitalize() for w in weathers)),
+                            on_result=lambda item_result: manifest.append(item_result.records), missing=missing)
+        finally:
+            manifest.close()
+            if self._shards is not None:
+                self._shards.close()
+
+        if rain_from_diff:
+            for sequence in sequences:
+                rain_levels_dir = os.path.join(self.datasets_directory, self.name, sequence, "rain_diff")
+
+                shutil.rmtree(rain_levels_dir, ignore_errors=True)
+
+    def _manifest_path(self):
+        return os.path.join(self.datasets_directory, self.name, "manifest.jsonl")
+
+    def _generation_params(self, weather):
+        # As read back from the manifest, e.g. tuples become lists
+        transform = json.loads(json.dumps([type(self).__name__, self.transform_params()]))
+        if weather == "fog":
+            params = {"transform": transform, "linf": self._fog_kernel.linf}
+        else:
+            params = {"transform": transform, "wrap_diff": self._diff_kernel.wrap}
+        params.update(self.encoding.params())
+        return params
+
+    def _signature(self, source, root=None):
+        # Identify an input by its path relative to root (datasets_directory by default), size and mtime. Archive
+        # members are relative to datasets_directory as well and have the mtime of their extracted file, hence the
+        # same signature whether they are extracted or streamed, from any output_dir
+        if isinstance(source, str):
+            st = os.stat(source)
+            relative_path = os.path.relpath(source, root or self.datasets_directory).replace(os.sep, "/")
+            return [relative_path, st.st_size, st.st_mtime_ns]
+        archive, member = source
+        info = self._archive(archive).getinfo(member)
+        return [member, info.file_size, member_mtime_ns(info)]
+
+    def _level_directory(self, sequence, weather, level):
+        # With shards, output paths are relative paths inside the shard directory of the level
+        level_directory = os.path.join(self.datasets_directory, self.name, sequence, weather, level)
+        return level_directory + SHARDS_SUFFIX if self._shards is not None else level_directory
+
+    def _fog_output(self, sequence, vmax, sub_folders, filename):
+        return self.encoding.path(os.path.join(self._level_directory(sequence, "fog", vmax), sub_folders, filename))
+
+    def _rain_outputs(self, sequence, rain_level, sub_folders, filename):
+        rain_dir = self._level_directory(sequence, "rain", rain_level)
+        # Masks are copied as they are, only the rainy images follow the output format
+        return (self.encoding.path(os.path.join(rain_dir, "rainy_image", sub_folders, filename)),
+                os.path.join(rain_dir, "rain_mask", sub_folders, filename))
+
+    def _stale_variants(self, manifest, sequence, sub_folders, filename, variants):
+        # Return the fog and rain variants to generate, each with its signature, and the number of outputs skipped
+        try:
+            original = self._signature(os.path.join(self.original_dir, sequence, sub_folders, filename), self.original_dir)
+        except OSError:
+            # Missing original, reported by the worker
+            return [v + (None,) for v in variants["fog"]], [v + (None,) for v in variants["rain"]], 0
+
+        fog_variants, rain_variants, skipped = [], [], 0
+        for vmax, fog_transmittance in variants["fog"]:
+            signature = [original, self._signature(fog_transmittance), self._generation_params("fog")]
+            if not self.force and manifest.is_up_to_date(self._fog_output(sequence, vmax, sub_folders, filename), signature):
+                skipped += 1
+            else:
+                fog_variants.append((vmax, fog_transmittance, signature))
 
-            for_transmission_dir = os.path.join(self.datasets_directory, self.name, sequence, "fog_transmittance")
+        for rain_level, rain_diff, rain_mask in variants["rain"]:
+            signature = [original, self._signature(rain_diff), self._signature(rain_mask), self._generation_params("rain")]
+            outputs = self._rain_outputs(sequence, rain_level, sub_folders, filename)
+            if not self.force and all(manifest.is_up_to_date(output, signature) for output in outputs):
+                skipped += len(outputs)
+            else:
+                rain_variants.append((rain_level, rain_diff, rain_mask, signature))
 
-            if not os.path.isdir(for_transmission_dir):
-                raise NotADirectoryError("fog_transmittance folder doesn't exist")
+        return fog_variants, rain_variants, skipped
 
-            vmax_list = os.listdir(for_transmission_dir)
+    def _archive(self, archive):
+        return self._archives.get(archive, ZipFile)
 
-            fog_dir = os.path.join(self.datasets_directory, self.name, sequence, "fog")
+    def _close_archive(self, archive):
+        self._archives.pop(archive)
 
-            for vmax_idx, vmax in enumerate(vmax_list):
-                print("     {}, Sequence [{}/{}], Fog vmax {} [{}/{}]".format(self.name, seq_idx+1, len(self.sequences), vmax, vmax_idx+1, len(vmax_list)))
-                files = glob.glob(os.path.join(for_transmission_dir, vmax, "**/*.png"), recursive=True)
-                for fog_transmittance_path in tqdm(files, desc="        {}, Fog, {}, {}".format(self.name, vmax, sequence)):
-                    relative_path_to_filename = fog_transmittance_path.replace(os.path.join(for_transmission_dir, vmax) + "/", "")
-                    filename = os.path.basename(relative_path_to_filename)
-                    sub_folders = relative_path_to_filename.replace(filename, "")
+    def _sources(self, sequence, data, archives=None):
+        # Map the path, relative to <name>/<sequence>/<data>/, of every png to its file, or to its (archive, member)
+        # when streaming from archives
+        if archives is not None:
+            prefix = "/".join([self.name, sequence, data]) + "/"
+            sources = {}
+            for archive in archives:
+                for member in self._archive(archive).namelist():
+                    if member.startswith(prefix) and member.endswith(".png"):
+                        sources[member[len(prefix):]] = (archive, member)
+            return sources
 
-                    original_file_path = os.path.join(self.original_dir, sequence, sub_folders, filename)
-                    if not os.path.isfile(original_file_path):
-                        print("File {} doesn't exist".format(original_file_path))
-                        continue
+        directory = os.path.join(self.datasets_directory, self.name, sequence, data)
+        return {path: os.path.join(directory, path) for path in self._file_index.files(directory)}
 
-                    img_clear = cv2.imread(original_file_path)
-                    img_clear = self.transform_original_image(img_clear)
-                    fog_output_dir = os.path.join(fog_dir, vmax, sub_folders)
+    def _has_original(self, sequence, sub_folders, filename):
+        # From the index of the originals of the sequence, listed on the first call
+        return self._file_index.contains(os.path.join(self.original_dir, sequence), sub_folders + "/" + filename if sub_folders else filename)
 
-                    os.makedirs(fog_output_dir, exist_ok=True)
+    def _sequence_header(self, sequence):
+        return "     {}, Sequence [{}/{}]".format(self.name, self.sequences.index(sequence)+1, len(self.sequences))
 
-                    fog_transmittance = cv2.imread(fog_transmittance_path, cv2.IMREAD_UNCHANGED) / 255.
+    def _variants(self, work, sequence, relative_path_to_filename):
+        # Relative paths are '/' separated, from the file index or archive members
+        sub_folders, _, filename = relative_path_to_filename.rpartition("/")
+        return work.setdefault((sequence, sub_folders, filename), {"fog": [], "rain": []})
 
-                    LInf = np.array([200, 200, 200])  # Atmosphere chromacity
+    def _collect_fog(self, sequence, work, archives=None):
+        sequence_data = self.data[sequence] if sequence in self.data.keys() else self.data["*"]
+        if "fog_transmittance" not in sequence_data:
+            print(sequence+", No fog data in this sequence.")
+            return
 
-                    direct_trans_noise = img_clear * fog_transmittance
-                    airlight_noise = LInf * (1 - fog_transmittance)
-                    img_fog = direct_trans_noise + airlight_noise
-                    img_fog = np.asarray(img_fog, dtype=np.uint8)
+        for_transmission_dir = os.path.join(self.datasets_directory, self.name, sequence, "fog_transmittance")
 
-                    cv2.imwrite(os.path.join(fog_output_dir, filename), img_fog)
+        if archives is None and not os.path.isdir(for_transmission_dir):
+            raise NotADirectoryError("fog_transmittance folder doesn't exist")
 
-    def generate_rain(self):
-        sequence_data = self.data["*"]
-        if "rain_diff" in sequence_data:
-            self.generate_rain_from_diff()
-        elif "rain" in sequence_data:
-            return  # Nothing to do
-        else:
-            raise NotImplementedError
+        sources = self._sources(sequence, "fog_transmittance", archives)
+        vmax_list = sorted(set(path.split("/", 1)[0] for path in sources))
 
-    def generate_rain_from_diff(self):
-        for seq_idx, sequence in enumerate(self.sequences):
-            rain_levels_dir = os.path.join(self.datasets_directory, self.name, sequence, "rain_diff")
+        for vmax_idx, vmax in enumerate(vmax_list):
+            print("{}, Fog vmax {} [{}/{}]".format(self._sequence_header(sequence), vmax, vmax_idx+1, len(vmax_list)))
 
-            if not os.path.isdir(rain_levels_dir):
-                rain_levels_dir = os.path.join(self.datasets_directory, self.name, sequence, "rain")
-                if os.path.isdir(rain_levels_dir):
-                    print("     Rain seems already generated in ({}). Skipping...".format(rain_levels_dir))
-                    continue
-                else:
-                    raise NotADirectoryError("rain_diff folder doesn't exist")
+        for path, fog_transmittance in sources.items():
+            vmax, relative_path_to_filename = path.split("/", 1)
+            self._variants(work, sequence, relative_path_to_filename)["fog"].append((vmax, fog_transmittance))
 
-            levels_list = os.listdir(rain_levels_dir)
+    def _collect_rain(self, sequence, work, archives=None):
+        rain_levels_dir = os.path.join(self.datasets_directory, self.name, sequence, "rain_diff")
+        sources = self._sources(sequence, "rain_diff", archives)
 
-            rain_dir = os.path.join(self.datasets_directory, self.name, sequence, "rain")
+        if not os.path.isdir(rain_levels_dir) and not sources:
+            rain_levels_dir = os.path.join(self.datasets_directory, self.name, sequence, "rain")
+            if os.path.isdir(rain_levels_dir):
+                print("     Rain seems already generated in ({}). Skipping...".format(rain_levels_dir))
+                return
+            else:
+                raise NotADirectoryError("rain_diff folder doesn't exist")
 
-            for rain_idx, rain_level in enumerate(levels_list):
-                print("     {}, Sequence [{}/{}], Rain {} [{}/{}]".format(self.name, seq_idx+1, len(self.sequences), rain_level, rain_idx+1, len(levels_list)))
-                files = glob.glob(os.path.join(rain_levels_dir, rain_level, "rainy_image", "**/*.png"), recursive=True)
-                for rain_diff_path in tqdm(files, desc="        {}, Rain, {}, {}".format(self.name, rain_level, sequence)):
-                    relative_path_to_filename = rain_diff_path.replace(os.path.join(rain_levels_dir, rain_level, "rainy_image") + "/", "")
+        levels_list = sorted(set(path.split("/", 1)[0] for path in sources))
 
-                    filename = os.path.basename(relative_path_to_filename)
-                    sub_folders = relative_path_to_filename.replace(filename, "")
+        for rain_idx, rain_level in enumerate(levels_list):
+            print("{}, Rain {} [{}/{}]".format(self._sequence_header(sequence), rain_level, rain_idx+1, len(levels_list)))
 
-                    rainy_image_output_dir = os.path.join(rain_dir, rain_level, "rainy_image", sub_folders)
-                    rain_mask_output_dir = os.path.join(rain_dir, rain_level, "rain_mask", sub_folders)
+        for path, rain_diff in sources.items():
+            rain_level, kind, relative_path_to_filename = path.split("/", 2)
+            if kind != "rainy_image":
+                continue
 
-                    original_file_path = os.path.join(self.original_dir, sequence, sub_folders, filename)
+            rain_mask = sources.get("/".join([rain_level, "rain_mask", relative_path_to_filename]))
+            if rain_mask is None:
+                rain_mask = os.path.join(rain_levels_dir, rain_level, "rain_mask", relative_path_to_filename)
+            self._variants(work, sequence, relative_path_to_filename)["rain"].append((rain_level, rain_diff, rain_mask))
+
+    def _imread(self, source, flags=cv2.IMREAD_UNCHANGED):
+        # Read an image from a file, or from an (archive, member) pair
+        with self.metrics.time("read"):
+            if isinstance(source, str):
+                return cv2.imread(source, flags)
+            archive, member = source
+            return cv2.imdecode(np.frombuffer(self._archive(archive).read(member), dtype=np.uint8), flags)
+
+    def _write_image(self, output_file, img):
+        # Encode and write, on a writer thread if any. Return a future to wait for before using the file, or None
+        if self._writer.threads > 0:
+            img = img.copy()  # Kernel output buffers are reused by the next frame
+        if self._shards is not None:
+            return self._writer.submit(self._write_shard, output_file, img)
+        return self._writer.submit(self._encode_and_write, output_file, img)
+
+    def _write_shard(self, output_file, img):
+        with self.metrics.time("write"):
+            written = self._shards.write(output_file, img)
+        self.metrics.count("images_written")
+        self.metrics.count("bytes_written", written)
+
+    def _record(self, manifest_directory, output_file, signature):
+        if self._shards is not None:
+            return make_shard_record(manifest_directory, output_file, self._shards.part_file(output_file), signature)
+        return make_record(manifest_directory, output_file, signature)
+
+    def _encode_and_write(self, output_file, img):
+        with self.metrics.time("encode"):
+            encoded = self.encoding.encode(img)
+        with self.metrics.time("write"):
+            with open(output_file, "wb") as f:
+                f.write(encoded)
+        self.metrics.count("images_written")
+        self.metrics.count("bytes_written", len(encoded))
+
+    def _makedirs(self, directory):
+        if self._shards is not None:
+            return  # Shard directories are created by the writer
+        with self.metrics.time("fs"):
+            os.makedirs(directory, exist_ok=True)
+
+    def _copy(self, source, output_file):
+        with self.metrics.time("copy"):
+            if isinstance(source, str):
+                shutil.copyfile(source, output_file)
+                return
+            archive, member = source
+            with self._archive(archive).open(member) as src, open(output_file, "wb") as dst:
+                shutil.copyfileobj(src, dst)
+
+    def _load_original(self, original_file_path):
+        if self._originals_store is None:
+            return self._transform_original(original_file_path)
+        hits = self._originals_store.hits
+        img_clear = self._originals_store.get(original_file_path, self._transform_original)
+        self.metrics.count("stored_originals_hits" if self._originals_store.hits > hits else "stored_originals_misses")
+        return img_clear
+
+    def _transform_original(self, original_file_path):
+        img_clear = self._imread(original_file_path, cv2.IMREAD_COLOR)
+        if img_clear is None:
+            raise FileNotFoundError("Can't read {}".format(original_file_path))
+        with self.metrics.time("transform"):
+            return np.ascontiguousarray(self.transform_original_image(img_clear))
+
+    def _generate_originals(self, items):
+        # Every fog and rain variant of a batch of originals, composited one frame at a time
+        result = _ItemResult()
+        writes = []  # (future, output files, signature), recorded once written
+
+        for sequence, sub_folders, filename, fog_variants, rain_variants in items:
+            original_file_path = os.path.join(self.original_dir, sequence, sub_folders, filename)
+            try:
+                img_clear = self._load_original(original_file_path)
+            except FileNotFoundError:
+                # Removed since the originals were listed
+                result.missing.append(original_file_path)
+                continue
 
-                    os.makedirs(rainy_image_output_dir, exist_ok=True)
+            for vmax, fog_transmittance_source, signature in fog_variants:
+                fog_output_file = self._fog_output(sequence, vmax, sub_folders, filename)
+                self._makedirs(os.path.dirname(fog_output_file))
 
-                    os.makedirs(rain_mask_output_dir, exist_ok=True)
+                fog_transmittance = self._imread(fog_transmittance_source)
+                with self.metrics.time("compute"):
+                    img_fog = self._fog_kernel(img_clear, fog_transmittance)
 
-                    shutil.copyfile(os.path.join(rain_levels_dir, rain_level, "rain_mask", sub_folders, filename),
-                                    os.path.join(rain_mask_output_dir, filename))
-                    self._apply_diff(original_file_path, rain_diff_path, os.path.join(rainy_image_output_dir, filename))
+                writes.append((self._write_image(fog_output_file, img_fog), [fog_output_file], signature))
 
-        for sequence in self.sequences:
-            rain_levels_dir = os.path.join(self.datasets_directory, self.name, sequence, "rain_diff")
+            for rain_level, rain_diff_source, rain_mask_source, signature in rain_variants:
+                rainy_image_output_file, rain_mask_output_file = self._rain_outputs(sequence, rain_level, sub_folders, filename)
+
+                self._makedirs(os.path.dirname(rainy_image_output_file))
+
+                self._makedirs(os.path.dirname(rain_mask_output_file))
+
+                if self._shards is not None:
+                    mask_written = self._write_image(rain_mask_output_file, self._imread(rain_mask_source))
+                else:
+                    mask_written = self._copy(rain_mask_source, rain_mask_output_file)
+                writes.append((mask_written, [rain_mask_output_file], signature))
+                future = self._apply_diff(img_clear, rain_diff_source, rainy_image_output_file)
+                writes.append((future, [rainy_image_output_file], signature))
+
+        manifest_directory = os.path.dirname(self._manifest_path())
+        for future, output_files, signature in writes:
+            if future is not None:
+                future.result()
+            for output_file in output_files:
+                result.records.append(self._record(manifest_directory, output_file, signature))
+
+        return result
+
+    def _run_items(self, method_name, items, desc, on_result=None, missing=()):
+        # Run self.<method_name>(item) for every item, in this process or spread across a pool of workers,
+        # and merge the _ItemResult they return. on_result is called in this process with every _ItemResult.
+        # missing are the original files already known to be missing, reported with the others.
+        result = _ItemResult()
+        result.missing.extend(missing)
+        if self.workers > 1 and len(items) > 1:
+            chunksize = max(1, min(64, len(items) // (self.workers * 8)))
+            with multiprocessing.Pool(processes=self.workers, initializer=_init_worker, initargs=(pickle.dumps(self),)) as pool:
+                item_results = pool.imap_unordered(_run_worker_item, [(method_name, item) for item in items], chunksize=chunksize)
+                for item_result in tqdm(item_results, total=len(items), desc=desc):
+                    self.metrics.merge(item_result.metrics)
+                    result.merge(item_result)
+                    if on_result is not None:
+                        on_result(item_result)
+        else:
+            method = getattr(self, method_name)
+            for item in tqdm(items, desc=desc):
+                item_result = method(item)
+                result.merge(item_result)
+                if on_result is not None:
+                    on_result(item_result)
+
+        for original_file_path in sorted(result.missing):
+            print("File {} doesn't exist".format(original_file_path))
+
+        self.metrics.count("items", len(items))
+        self.metrics.count("missing_originals", len(result.missing))
 
-            shutil.rmtree(rain_levels_dir, ignore_errors=True)
+        return result
 
     # Apply differential image
-    def _apply_diff(self, raw_file, diff_file, output_file):
+    def _apply_diff(self, clear_image, diff_file, output_file):
         # Read images
-        clear_image = cv2.imread(raw_file)
-        diff_image = cv2.imread(diff_file, cv2.IMREAD_UNCHANGED)
-        clear_image = self.transform_original_image(clear_image)
+        diff_image = self._imread(diff_file)
 
         # Generate augmented image
-        clear_image = clear_image.astype(np.uint16)
-        diff_image = diff_image.astype(np.uint16)
-        augmented_image = (diff_image - 255).astype(np.int16) + clear_image
+        with self.metrics.time("compute"):
+            augmented_image = self._diff_kernel(clear_image, diff_image)
 
-        cv2.imwrite(output_file, augmented_image.astype(np.uint8))
\ No newline at end of file
+        return self._write_image(output_file, augmented_image)
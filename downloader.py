@@ -0,0 +1,246 @@
+######################################################################################################################
+# Halder, S. S., Lalonde, J. F., & de Charette, R. (2019).
+# Physics-Based Rendering for Improving Robustness to Rain. IEEE/CVF International Conference on Computer Vision
+#
+# From: Computer Vision Group, RITS team, Inria
+# License: MIT
+######################################################################################################################
+
+import os
+import json
+import time
+import hashlib
+import threading
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from tqdm import tqdm
+
+
+def sha256sum(filename, blocksize=8 << 20):
+    # Large unbuffered reads into a single buffer, hashlib releases the GIL so that files can be hashed concurrently
+    hash_sha256 = hashlib.sha256()
+    buffer = bytearray(blocksize)
+    view = memoryview(buffer)
+    with open(filename, "rb", buffering=0) as f:
+        for n in iter(lambda: f.readinto(buffer), 0):
+            hash_sha256.update(view[:n])
+    return hash_sha256.hexdigest()
+
+
+class ChecksumCache:
+    """sha256 digests of files, persisted in a JSON sidecar and keyed by (path, size, mtime_ns, inode).
+
+    An unchanged file is not hashed again, unless `verify` is set.
+    """
+
+    def __init__(self, path, verify=False):
+        self.path = path
+        self.verify = verify
+        self._lock = threading.Lock()
+        self._entries = {}
+        try:
+            with open(path) as f:
+                self._entries = {file: entry for file, entry in json.load(f).items() if os.path.isfile(file)}
+        except (OSError, ValueError):
+            pass
+
+    @staticmethod
+    def _key(path):
+        st = os.stat(path)
+        return [st.st_size, st.st_mtime_ns, st.st_ino]
+
+    def _store(self, path, key, digest):
+        with self._lock:
+            self._entries[os.path.abspath(path)] = {"key": key, "sha256": digest}
+            with open(self.path + ".tmp", "w") as f:
+                json.dump(self._entries, f)
+            os.replace(self.path + ".tmp", self.path)
+
+    def sha256sum(self, path):
+        key = self._key(path)
+        entry = self._entries.get(os.path.abspath(path))
+        if not self.verify and entry is not None and entry["key"] == key:
+            return entry["sha256"]
+
+        tqdm.write("     Calculating checksum: {}".format(os.path.basename(path)))
+        digest = sha256sum(path)
+        self._store(path, key, digest)
+        return digest
+
+    def moved(self, src, dst):
+        # Keep the digest of a file renamed from src to dst
+        entry = self._entries.get(os.path.abspath(src))
+        if entry is not None:
+            self._store(dst, self._key(dst), entry["sha256"])
+
+
+class _PartState:
+    # Progress of a partial download, saved next to the .part file so that an interrupted download can be resumed.
+    # segments are [start, end, written] lists, end excluded.
+    def __init__(self, path, url, size, segments):
+        self.path = path
+        self.url = url
+        self.size = size
+        self.segments = segments
+        self._lock = threading.Lock()
+        self._saved = 0
+
+    @classmethod
+    def load(cls, path, url, size):
+        try:
+            with open(path) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if state.get("url") != url or state.get("size") != size:
+            return None
+        return cls(path, url, size, state["segments"])
+
+    def save(self, force=False):
+        with self._lock:
+            if not force and time.monotonic() - self._saved < 1.:
+                return
+            self._saved = time.monotonic()
+            with open(self.path + ".tmp", "w") as f:
+                json.dump({"url": self.url, "size": self.size, "segments": self.segments}, f)
+            os.replace(self.path + ".tmp", self.path)
+
+
+class DownloadManager:
+    """Downloads several files at once into a directory.
+
+    Files served with byte-range support are split in up to `segments` parallel ranges and are downloaded to
+    a `.part` file which is resumed after an interruption. A file is only moved to its final name once its sha256
+    matches `checksums` (filename -> hexdigest), files without a known checksum are moved as is.
+    Pre-downloaded files are checked concurrently as well, through `checksum_cache` when given.
+    """
+
+    def __init__(self, directory, checksums=None, max_downloads=4, segments=4, min_segment_size=32 << 20,
+                 checksum_cache=None, blocksize=1 << 20, retries=3, timeout=60):
+        self.directory = directory
+        self.checksums = checksums if checksums is not None else {}
+        self.max_downloads = max(1, max_downloads)
+        self.segments = max(1, segments)
+        self.min_segment_size = min_segment_size
+        self.checksum_cache = checksum_cache
+        self.blocksize = blocksize
+        self.retries = retries
+        self.timeout = timeout
+        self._progress = None
+        self._progress_lock = threading.Lock()
+
+    def _update_progress(self, n=0, total=0):
+        with self._progress_lock:
+            if self._progress is not None:
+                if total:
+                    self._progress.total = (self._progress.total or 0) + total
+                    self._progress.refresh()
+                if n:
+                    self._progress.update(n)
+
+    def _is_valid(self, path, filename):
+        if filename not in self.checksums:
+            return False
+        digest = self.checksum_cache.sha256sum(path) if self.checksum_cache is not None else sha256sum(path)
+        return self.checksums[filename] == digest
+
+    def download_all(self, urls):
+        # Yield the path of every downloaded file, as soon as it is available
+        with tqdm(total=0, unit='B', unit_scale=True, unit_divisor=1024, desc="     Downloading") as self._progress:
+            with ThreadPoolExecutor(max_workers=self.max_downloads) as executor:
+                futures = [executor.submit(self.download, url) for url in urls]
+                for future in as_completed(futures):
+                    yield future.result()
+        self._progress = None
+
+    def download(self, url, overwrite=False):
+        filename = url.split('/')[-1]
+        path = os.path.join(self.directory, filename)
+
+        # Redownload this file only if the checksum is invalid
+        if not overwrite and os.path.isfile(path):
+            if self._is_valid(path, filename):
+                tqdm.write("     Using pre-downloaded file: {}".format(filename))
+                return path
+            tqdm.write("     Sha256sum is invalid: {}. Will re-download".format(filename))
+
+        for attempt in range(2):
+            self._download_part(url, path + ".part")
+            if filename not in self.checksums or self._is_valid(path + ".part", filename):
+                os.replace(path + ".part", path)
+                if self.checksum_cache is not None:
+                    self.checksum_cache.moved(path + ".part", path)
+                return path
+            tqdm.write("     Sha256sum is invalid after download: {}.{}".format(filename, " Will re-download" if attempt == 0 else ""))
+            os.remove(path + ".part")
+
+        raise IOError("Downloaded file {} doesn't match its checksum".format(filename))
+
+    def _probe(self, url):
+        # Return the size of the file (None if unknown) and whether byte ranges are supported
+        request = urllib.request.Request(url, headers={"Range": "bytes=0-0"})
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            if response.status == 206 and "/" in response.headers.get("Content-Range", ""):
+                size = response.headers["Content-Range"].rsplit("/", 1)[1]
+                if size != "*":
+                    return int(size), True
+            length = response.headers.get("Content-Length")
+            return (int(length) if length is not None else None), False
+
+    def _download_part(self, url, part_path):
+        state_path = part_path + ".json"
+        size, accept_ranges = self._probe(url)
+
+        if not accept_ranges:
+            # Plain stream, cannot be resumed
+            self._update_progress(total=size or 0)
+            with urllib.request.urlopen(url, timeout=self.timeout) as response, open(part_path, "wb") as f:
+                for block in iter(lambda: response.read(self.blocksize), b""):
+                    f.write(block)
+                    self._update_progress(len(block))
+            return
+
+        state = _PartState.load(state_path, url, size) if os.path.isfile(part_path) else None
+        if state is None:
+            n_segments = max(1, min(self.segments, size // self.min_segment_size))
+            bounds = [size * i // n_segments for i in range(n_segments + 1)]
+            state = _PartState(state_path, url, size, [[bounds[i], bounds[i+1], 0] for i in range(n_segments)])
+            with open(part_path, "wb") as f:
+                f.truncate(size)
+            state.save(force=True)
+        else:
+            tqdm.write("     Resuming: {}".format(url.split('/')[-1]))
+
+        self._update_progress(total=size)
+        self._update_progress(sum(written for _, _, written in state.segments))
+
+        with ThreadPoolExecutor(max_workers=len(state.segments)) as executor:
+            for future in [executor.submit(self._download_segment, url, part_path, segment, state) for segment in state.segments]:
+                future.result()
+
+        state.save(force=True)
+        os.remove(state_path)
+
+    def _download_segment(self, url, part_path, segment, state):
+        start, end = segment[0], segment[1]
+        attempt = 0
+        while start + segment[2] < end:
+            request = urllib.request.Request(url, headers={"Range": "bytes={}-{}".format(start + segment[2], end - 1)})
+            try:
+                # Unbuffered, so that the saved state never gets ahead of the data handed to the OS
+                with urllib.request.urlopen(request, timeout=self.timeout) as response, open(part_path, "r+b", buffering=0) as f:
+                    if response.status != 206:
+                        raise IOError("Server ignored range request for {}".format(url))
+                    f.seek(start + segment[2])
+                    for block in iter(lambda: response.read(min(self.blocksize, end - start - segment[2])), b""):
+                        f.write(block)
+                        segment[2] += len(block)
+                        self._update_progress(len(block))
+                        state.save()
+                if start + segment[2] < end:
+                    raise IOError("Connection closed before the end of the range for {}".format(url))
+            except OSError:
+                attempt += 1
+                if attempt > self.retries:
+                    state.save(force=True)
+                    raise
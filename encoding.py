@@ -0,0 +1,68 @@
+######################################################################################################################
+# Halder, S. S., Lalonde, J. F., & de Charette, R. (2019).
+# Physics-Based Rendering for Improving Robustness to Rain. IEEE/CVF International Conference on Computer Vision
+#
+# From: Computer Vision Group, RITS team, Inria
+# License: MIT
+######################################################################################################################
+
+import io
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import cv2
+
+
+class OutputEncoding:
+    """Format of the generated images: PNG with an optional compression level (0 is the fastest, OpenCV's default
+    otherwise), lossless WebP, or raw .npy arrays. The output extension follows the format."""
+
+    FORMATS = ("png", "webp", "npy")
+
+    def __init__(self, format="png", png_compression=None):
+        if format not in OutputEncoding.FORMATS:
+            raise ValueError("Unknown output format: {}".format(format))
+        self.format = format
+        self.png_compression = png_compression
+
+    def params(self):
+        # Part of the generation parameters recorded in the manifest
+        return {"format": self.format, "png_compression": self.png_compression}
+
+    def path(self, output_file):
+        return os.path.splitext(output_file)[0] + "." + self.format
+
+    def encode(self, img):
+        if self.format == "npy":
+            buffer = io.BytesIO()
+            np.save(buffer, img)
+            return buffer.getbuffer()
+
+        if self.format == "webp":
+            params = [cv2.IMWRITE_WEBP_QUALITY, 101]  # Above 100 is lossless
+        elif self.png_compression is not None:
+            params = [cv2.IMWRITE_PNG_COMPRESSION, self.png_compression]
+        else:
+            params = []
+        _, encoded = cv2.imencode("." + self.format, img, params)
+        return encoded
+
+
+class WriterPool:
+    """Threads encoding and writing images while the next frame is computed.
+
+    With 0 threads, submit runs the function right away and returns None. The executor is created lazily.
+    """
+
+    def __init__(self, threads=0):
+        self.threads = threads
+        self._executor = None
+
+    def submit(self, fn, *args):
+        if self.threads <= 0:
+            fn(*args)
+            return None
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.threads)
+        return self._executor.submit(fn, *args)
@@ -0,0 +1,87 @@
+######################################################################################################################
+# Halder, S. S., Lalonde, J. F., & de Charette, R. (2019).
+# Physics-Based Rendering for Improving Robustness to Rain. IEEE/CVF International Conference on Computer Vision
+#
+# From: Computer Vision Group, RITS team, Inria
+# License: MIT
+######################################################################################################################
+
+import os
+import time
+import zlib
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from zipfile import ZipFile
+from tqdm import tqdm
+
+
+def file_crc32(path, blocksize=1 << 20):
+    crc = 0
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(blocksize), b""):
+            crc = zlib.crc32(block, crc)
+    return crc
+
+
+def member_mtime_ns(info):
+    # Modification time stored in the archive, given to the extracted file as unzip does
+    return int(time.mktime(info.date_time + (0, 0, -1))) * 10**9
+
+
+class Extractor:
+    """Extracts the members of a zip archive with a pool of threads, each reading from its own ZipFile handle.
+
+    Members already on disk with the same size and CRC32 are skipped. Files are written to a `.part` file and
+    renamed once complete, so an interrupted extraction never leaves a truncated file under its final name.
+    Extracted files get the modification time of their member, so that they have the same signature in the
+    manifest as the member read straight from the archive.
+    """
+
+    def __init__(self, archive, threads=8):
+        self.archive = archive
+        self.threads = max(1, threads)
+        self._local = threading.local()
+
+    def _zip_file(self):
+        if not hasattr(self._local, "zip_file"):
+            self._local.zip_file = ZipFile(file=self.archive)
+        return self._local.zip_file
+
+    @staticmethod
+    def target_path(member, directory):
+        # Same sanitization as ZipFile.extract: no absolute path, no '..'
+        parts = [part for part in member.replace("\\", "/").split("/") if part not in ("", ".", "..")]
+        return os.path.join(directory, *parts)
+
+    def _extract_member(self, info, directory):
+        # Return True if the member was written, False if it was already on disk
+        target = self.target_path(info.filename, directory)
+        if info.is_dir():
+            os.makedirs(target, exist_ok=True)
+            return True
+
+        mtime = member_mtime_ns(info)
+        if os.path.isfile(target) and os.path.getsize(target) == info.file_size and file_crc32(target) == info.CRC:
+            if os.stat(target).st_mtime_ns != mtime:
+                os.utime(target, ns=(mtime, mtime))  # Extracted before mtimes were kept
+            return False
+
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        with self._zip_file().open(info) as src, open(target + ".part", "wb") as dst:
+            shutil.copyfileobj(src, dst, 1 << 20)
+        os.utime(target + ".part", ns=(mtime, mtime))
+        os.replace(target + ".part", target)
+        return True
+
+    def extract(self, directory, skip=None, desc=None):
+        # Extract every member but those for which skip(member name) is true, return (extracted, skipped) counts
+        with ZipFile(file=self.archive) as zip_file:
+            infos = [info for info in zip_file.infolist() if skip is None or not skip(info.filename)]
+
+        extracted = 0
+        with ThreadPoolExecutor(max_workers=self.threads) as executor:
+            for written in tqdm(executor.map(lambda info: self._extract_member(info, directory), infos), total=len(infos), desc=desc):
+                extracted += written
+
+        return extracted, len(infos) - extracted
@@ -0,0 +1,92 @@
+######################################################################################################################
+# Halder, S. S., Lalonde, J. F., & de Charette, R. (2019).
+# Physics-Based Rendering for Improving Robustness to Rain. IEEE/CVF International Conference on Computer Vision
+#
+# From: Computer Vision Group, RITS team, Inria
+# License: MIT
+######################################################################################################################
+
+import os
+import json
+import time
+
+# Directories modified less than this before being listed are listed again next time: on filesystems with coarse
+# timestamps (NFS, FAT, ...) a file added in the same tick as the listing leaves the mtime unchanged
+RACY_NS = 2 * 10**9
+
+
+class FileIndex:
+    """Files under directory trees, listed in a single os.scandir pass per tree, optionally persisted to a JSON file.
+
+    Each listed directory is kept with its mtime and the time it was listed. Listing a tree again only stats its
+    directories and lists those whose mtime changed, i.e. whose entries were added, removed or renamed, or whose
+    mtime wasn't clearly older than their listing ("racily clean", as git calls it). Lookups with `contains` never
+    touch the filesystem.
+    """
+
+    def __init__(self, path=None, suffix=".png"):
+        self.path = path
+        self.suffix = suffix
+        self.listed = 0  # Directories listed, as opposed to only stat'ed
+        self._trees = {}  # root -> {relative directory: [mtime_ns, files, subdirectories, listed_ns]}
+        self._files = {}  # root -> set of relative file paths
+
+        if path is not None and os.path.isfile(path):
+            try:
+                with open(path) as f:
+                    self._trees = json.load(f)
+            except ValueError:
+                pass  # Truncated by an interrupted run, everything is listed again
+
+    def files(self, root):
+        # Sorted paths, relative to root and '/' separated, of the files under root. Empty if root doesn't exist
+        root = os.path.abspath(root)
+        tree = {}
+        try:
+            self._walk(root, self._trees.get(root, {}), tree, "")
+        except FileNotFoundError:
+            pass
+        self._trees[root] = tree
+
+        files = sorted(relative_directory + "/" + name if relative_directory else name
+                       for relative_directory, entry in tree.items() for name in entry[1])
+        self._files[root] = set(files)
+        return files
+
+    def contains(self, root, relative_path):
+        # Whether relative_path was under root when root was last listed
+        root = os.path.abspath(root)
+        if root not in self._files:
+            self.files(root)
+        return relative_path in self._files[root]
+
+    def _walk(self, root, old, new, relative_directory):
+        directory = os.path.join(root, *relative_directory.split("/")) if relative_directory else root
+        listed = time.time_ns()
+        mtime = os.stat(directory).st_mtime_ns  # Before listing, a change during the listing is seen next time
+        entry = old.get(relative_directory)
+        if entry is None or len(entry) < 4 or entry[0] != mtime or mtime + RACY_NS > entry[3]:
+            files, subdirectories = [], []
+            with os.scandir(directory) as entries:
+                for dir_entry in entries:
+                    if dir_entry.is_dir():
+                        subdirectories.append(dir_entry.name)
+                    elif dir_entry.name.endswith(self.suffix):
+                        files.append(dir_entry.name)
+            entry = [mtime, sorted(files), sorted(subdirectories), listed]
+            self.listed += 1
+        new[relative_directory] = entry
+
+        for name in entry[2]:
+            try:
+                self._walk(root, old, new, relative_directory + "/" + name if relative_directory else name)
+            except FileNotFoundError:
+                pass  # Removed since the listing
+
+    def save(self):
+        if self.path is None:
+            return
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path + ".tmp", "w") as f:
+            json.dump(self._trees, f)
+        os.replace(self.path + ".tmp", self.path)
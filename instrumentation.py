@@ -0,0 +1,147 @@
+######################################################################################################################
+# Halder, S. S., Lalonde, J. F., & de Charette, R. (2019).
+# Physics-Based Rendering for Improving Robustness to Rain. IEEE/CVF International Conference on Computer Vision
+#
+# From: Computer Vision Group, RITS team, Inria
+# License: MIT
+######################################################################################################################
+
+import os
+import json
+import time
+import pstats
+import threading
+import cProfile
+from collections import Counter
+from contextlib import contextmanager
+
+
+class _Timer:
+    __slots__ = ("metrics", "name", "start")
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.start
+        with self.metrics.lock:
+            self.metrics.seconds[self.name] += elapsed
+            self.metrics.calls[self.name] += 1
+
+
+class Metrics:
+    """Time spent and number of calls per stage (read, transform, compute, encode, write, copy, extract, ...),
+    and event counters.
+
+    Worker processes start from empty metrics and send theirs back with every work item, see drain and merge.
+    Updates are locked, writer threads record the encode and write stages.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.seconds = Counter()
+        self.calls = Counter()
+        self.counters = Counter()
+        self.started = time.time()
+
+    def time(self, stage):
+        return _Timer(self, stage)
+
+    def count(self, name, n=1):
+        with self.lock:
+            self.counters[name] += n
+
+    def drain(self):
+        # Return the metrics recorded so far and reset them
+        with self.lock:
+            drained = (self.seconds, self.calls, self.counters)
+            self.seconds, self.calls, self.counters = Counter(), Counter(), Counter()
+        return drained
+
+    def merge(self, drained):
+        if drained is not None:
+            seconds, calls, counters = drained
+            with self.lock:
+                self.seconds.update(seconds)
+                self.calls.update(calls)
+                self.counters.update(counters)
+
+    def summary(self):
+        return {"wall_seconds": round(time.time() - self.started, 3),
+                "stages": {stage: {"seconds": round(self.seconds[stage], 6),
+                                   "calls": self.calls[stage],
+                                   "mean_ms": round(1000 * self.seconds[stage] / max(1, self.calls[stage]), 3)}
+                           for stage in sorted(self.seconds)},
+                "counters": dict(sorted(self.counters.items()))}
+
+    def export_json(self, path):
+        with open(path, "w") as f:
+            json.dump(self.summary(), f, indent=2)
+
+    def export_prometheus(self, path):
+        # Text format for the node exporter textfile collector
+        lines = ["# HELP weather_stage_seconds_total Time spent per stage.",
+                 "# TYPE weather_stage_seconds_total counter"]
+        lines += ['weather_stage_seconds_total{{stage="{}"}} {}'.format(stage, self.seconds[stage]) for stage in sorted(self.seconds)]
+        lines += ["# HELP weather_stage_calls_total Number of calls per stage.",
+                  "# TYPE weather_stage_calls_total counter"]
+        lines += ['weather_stage_calls_total{{stage="{}"}} {}'.format(stage, self.calls[stage]) for stage in sorted(self.calls)]
+        lines += ["# HELP weather_events_total Events counted during the run.",
+                  "# TYPE weather_events_total counter"]
+        lines += ['weather_events_total{{name="{}"}} {}'.format(name, value) for name, value in sorted(self.counters.items())]
+        with open(path + ".tmp", "w") as f:
+            f.write("\n".join(lines) + "\n")
+        # Atomic, the collector may read the file at any time
+        os.replace(path + ".tmp", path)
+
+
+class _NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc):
+        pass
+
+
+class NullMetrics:
+    """Used when instrumentation is off, every call is a no-op."""
+
+    _timer = _NullTimer()
+
+    def time(self, stage):
+        return self._timer
+
+    def count(self, name, n=1):
+        pass
+
+    def drain(self):
+        return None
+
+    def merge(self, drained):
+        pass
+
+
+@contextmanager
+def session(metrics=None, profile=None, json_path=None, prometheus_path=None):
+    # Wrap a run: profile the main process with cProfile into `profile`, then export the metrics
+    profiler = cProfile.Profile() if profile else None
+    if profiler is not None:
+        profiler.enable()
+    try:
+        yield
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(profile)
+            pstats.Stats(profiler).sort_stats("cumulative").print_stats(25)
+        if metrics is not None:
+            if json_path:
+                metrics.export_json(json_path)
+            if prometheus_path:
+                metrics.export_prometheus(prometheus_path)
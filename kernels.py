@@ -0,0 +1,123 @@
+######################################################################################################################
+# Halder, S. S., Lalonde, J. F., & de Charette, R. (2019).
+# Physics-Based Rendering for Improving Robustness to Rain. IEEE/CVF International Conference on Computer Vision
+#
+# From: Computer Vision Group, RITS team, Inria
+# License: MIT
+######################################################################################################################
+
+import numpy as np
+import cv2
+
+LINF = 200  # Atmosphere chromacity
+
+
+def fog_reference(img_clear, fog_transmittance, linf=LINF):
+    # Original float64 formula, fog_transmittance is the 8 bits transmittance map as read from disk
+    fog_transmittance = fog_transmittance / 255.
+    LInf = np.array([linf, linf, linf])
+
+    direct_trans_noise = img_clear * fog_transmittance
+    airlight_noise = LInf * (1 - fog_transmittance)
+    img_fog = direct_trans_noise + airlight_noise
+    return np.asarray(img_fog, dtype=np.uint8)
+
+
+def fog_lut(linf=LINF):
+    # 256x256 table indexed by (clear pixel, transmittance), evaluated with the original formula so that
+    # the float64 rounding and the final truncation to uint8 are exactly the same
+    clear = np.arange(256, dtype=np.uint8)[:, None, None]
+    fog_transmittance = np.arange(256, dtype=np.uint8)[None, :, None]
+    return fog_reference(clear, fog_transmittance, linf=linf)[..., 0]
+
+
+class FogKernel:
+    """Fog compositing through a lookup table, without any float intermediate.
+
+    The index and output buffers are kept between calls and reused as long as the image shape doesn't change,
+    hence the returned image is overwritten by the next call unless an output array is passed with `out`.
+    """
+
+    def __init__(self, linf=LINF):
+        self.linf = linf
+        self.lut = fog_lut(linf).ravel()
+        self._index = None
+        self._output = None
+
+    def _buffers(self, shape):
+        if self._index is None or self._index.shape != shape:
+            self._index = np.empty(shape, dtype=np.uint16)
+            self._output = np.empty(shape, dtype=np.uint8)
+        return self._index, self._output
+
+    def __call__(self, img_clear, fog_transmittance, out=None):
+        if img_clear.dtype != np.uint8 or fog_transmittance.dtype != np.uint8:
+            return fog_reference(img_clear, fog_transmittance, linf=self.linf)
+
+        if fog_transmittance.ndim == img_clear.ndim - 1:
+            fog_transmittance = fog_transmittance[..., None]
+
+        index, output = self._buffers(img_clear.shape)
+        if out is not None:
+            output = out
+
+        # index = clear << 8 | transmittance
+        np.copyto(index, img_clear)
+        np.left_shift(index, 8, out=index)
+        np.bitwise_or(index, fog_transmittance, out=index)
+
+        return np.take(self.lut, index, out=output, mode='clip')
+
+
+def diff_reference(clear_image, diff_image):
+    # Original formula, values out of the uint8 range wrap around
+    clear_image = clear_image.astype(np.uint16)
+    diff_image = diff_image.astype(np.uint16)
+    augmented_image = (diff_image - 255).astype(np.int16) + clear_image
+    return augmented_image.astype(np.uint8)
+
+
+class DiffKernel:
+    """Applies a rain differential image, stored with an offset of 255, to a clear image.
+
+    By default the result saturates to [0, 255]. With `wrap=True` the original wrap-around of values out of the
+    uint8 range is reproduced bit for bit, i.e. (clear + diff - 255) modulo 256.
+    As for FogKernel, the returned image is a buffer reused by the next call unless `out` is given.
+    """
+
+    def __init__(self, wrap=False):
+        self.wrap = wrap
+        self._shape = None
+        self._dtype = None
+
+    def _buffers(self, shape, dtype):
+        if self._shape != shape or self._dtype != dtype:
+            self._shape, self._dtype = shape, dtype
+            self._offset = np.full(shape, 255, dtype=dtype)
+            self._scratch = np.empty(shape, dtype=dtype)
+            self._positive = np.empty(shape, dtype=np.uint8)
+            self._negative = np.empty(shape, dtype=np.uint8)
+            self._output = np.empty(shape, dtype=np.uint8)
+
+    def __call__(self, clear_image, diff_image, out=None):
+        self._buffers(diff_image.shape, diff_image.dtype)
+        output = self._output if out is None else out
+
+        if self.wrap:
+            # (clear + diff - 255) % 256 == (clear + diff + 1) % 256, the cast to uint8 drops the high bits
+            np.add(clear_image, diff_image, out=output, casting='unsafe')
+            return np.add(output, 1, out=output)
+
+        if diff_image.dtype == np.uint8:
+            # Offset diff can only darken the image
+            np.subtract(self._offset, diff_image, out=self._negative)
+            return cv2.subtract(clear_image, self._negative, dst=output)
+
+        # Split the signed diff in its positive and negative parts, both saturated to uint8
+        cv2.subtract(diff_image, self._offset, dst=self._scratch)
+        cv2.convertScaleAbs(self._scratch, dst=self._positive)
+        cv2.subtract(self._offset, diff_image, dst=self._scratch)
+        cv2.convertScaleAbs(self._scratch, dst=self._negative)
+
+        cv2.add(clear_image, self._positive, dst=output)
+        return cv2.subtract(output, self._negative, dst=output)
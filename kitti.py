@@ -14,17 +14,21 @@ from dataset import Dataset
 class Kitti(Dataset):
     sequences = ['data_object/training/image_2', 'raw_data/2011_09_26/2011_09_26_drive_0032_sync/image_02/data', 'raw_data/2011_09_26/2011_09_26_drive_0056_sync/image_02/data']
     data = {"*": ["depth", "fog_transmittance", "rain"]}
+    crop = (1216, 352)
 
-    def __init__(self, original_dir, output_dir, sequences=None):
+    def __init__(self, original_dir, output_dir, sequences=None, **kwargs):
         if sequences is None:
             sequences = Kitti.sequences
 
-        super().__init__("kitti", original_dir, output_dir, sequences, Kitti.data)
+        super().__init__("kitti", original_dir, output_dir, sequences, Kitti.data, **kwargs)
 
     def transform_original_image(self, img):
         # Crop-center original image
-        cropx, cropy = 1216, 352
+        cropx, cropy = Kitti.crop
         y, x, _ = img.shape
         startx = x // 2 - (cropx // 2)
         starty = y // 2 - (cropy // 2)
         return img[starty:starty + cropy, startx:startx + cropx]
+
+    def transform_params(self):
+        return {"crop": Kitti.crop}
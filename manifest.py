@@ -0,0 +1,101 @@
+######################################################################################################################
+# Halder, S. S., Lalonde, J. F., & de Charette, R. (2019).
+# Physics-Based Rendering for Improving Robustness to Rain. IEEE/CVF International Conference on Computer Vision
+#
+# From: Computer Vision Group, RITS team, Inria
+# License: MIT
+######################################################################################################################
+
+import os
+import json
+
+
+def output_stat(path):
+    st = os.stat(path)
+    return [st.st_size, st.st_mtime_ns]
+
+
+def make_record(directory, output_file, signature):
+    # Built by the process which wrote the output, appended to the manifest by the main process
+    return {"output": os.path.relpath(output_file, directory), "signature": signature, "stat": output_stat(output_file)}
+
+
+def make_shard_record(directory, output_file, part_file, signature):
+    # Output packed in a shard part, see shards.py
+    return {"output": os.path.relpath(output_file, directory), "signature": signature, "shard": os.path.relpath(part_file, directory)}
+
+
+class Manifest:
+    """Append-only JSONL record of generated outputs.
+
+    Each line maps an output path, relative to the manifest directory, to the signature it was generated from
+    (inputs sizes/mtimes and generation parameters) and to the size/mtime of the written output. The last line
+    of an output wins. An output is up to date when both its signature and its size/mtime are unchanged, or for
+    an output packed in a shard, when its signature is unchanged and its shard part still exists.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.directory = os.path.dirname(path)
+        self.records = {}
+        self._file = None
+
+        lines = 0
+        if os.path.isfile(path):
+            end = 0  # End of the last line ending with a newline
+            last_parsed = False
+            with open(path, "rb") as f:
+                for line in f:
+                    if line.endswith(b"\n"):
+                        end += len(line)
+                    try:
+                        record = json.loads(line)
+                        last_parsed = True
+                    except ValueError:
+                        last_parsed = False
+                        continue  # Line truncated by an interrupted run
+                    self.records[record["output"]] = record
+                    lines += 1
+            # The next record must start on its own line: end a complete last record, or drop a truncated one
+            if end < os.path.getsize(path):
+                with open(path, "r+b") as f:
+                    if last_parsed:
+                        f.seek(0, os.SEEK_END)
+                        f.write(b"\n")
+                    else:
+                        f.truncate(end)
+
+        # Compact the manifest once most of its lines are superseded
+        if lines > 2 * len(self.records) + 1000:
+            with open(path + ".tmp", "w") as f:
+                for record in self.records.values():
+                    f.write(json.dumps(record) + "\n")
+            os.replace(path + ".tmp", path)
+
+    def relative(self, output_file):
+        return os.path.relpath(output_file, self.directory)
+
+    def is_up_to_date(self, output_file, signature):
+        record = self.records.get(self.relative(output_file))
+        if record is None or record["signature"] != signature:
+            return False
+        if "shard" in record:
+            return os.path.isfile(os.path.join(self.directory, record["shard"]))
+        try:
+            return output_stat(output_file) == record["stat"]
+        except OSError:
+            return False
+
+    def append(self, records):
+        if self._file is None:
+            os.makedirs(self.directory, exist_ok=True)
+            self._file = open(self.path, "a")
+        for record in records:
+            self.records[record["output"]] = record
+            self._file.write(json.dumps(record) + "\n")
+        self._file.flush()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
@@ -10,11 +10,55 @@ import os
 from argparse import ArgumentParser
 from kitti import Kitti
 from cityscapes import Cityscapes
+from dataset import Dataset
+from instrumentation import Metrics
+from encoding import OutputEncoding
 
 file_dir = os.path.dirname(__file__)  # the directory that options.py resides in
 
 
-def parse():
+def add_generation_arguments(subparser):
+    subparser.add_argument("--workers", type=int, default=1, help="Number of processes used to generate foggy and rainy images")
+    subparser.add_argument("--batch_size", type=int, default=1, help="Number of originals per work item, larger items amortize the dispatch to worker processes")
+    subparser.add_argument("--store_originals", action="store_true", help="Keep the cropped/resized originals under output_dir, they are transformed once until the original file changes")
+    subparser.add_argument("--persist_index", action="store_true", help="Keep the listing of the original and weather files between runs, only changed directories are listed again")
+    subparser.add_argument("--force", action="store_true", help="Regenerate every image, even those already generated from the same inputs")
+    subparser.add_argument("--wrap_diff", action="store_true", help="Let rainy pixels out of the [0, 255] range wrap around instead of saturating, as in the original release")
+    subparser.add_argument("--format", type=str, choices=OutputEncoding.FORMATS, default="png", help="Format of the generated images: PNG, lossless WebP or raw numpy arrays")
+    subparser.add_argument("--png_compression", type=int, choices=range(10), help="PNG compression level, 0 is the fastest to write (default: OpenCV's)")
+    subparser.add_argument("--shards", action="store_true", help="Pack the images of each sequence, weather and level into memory-mappable shards instead of writing image files")
+    subparser.add_argument("--writer_threads", type=int, default=0, help="Number of threads per process encoding and writing images while the next ones are computed")
+
+
+def add_download_arguments(subparser):
+    subparser.add_argument("--http_path", type=str, default=Dataset.HTTP_PATH, help="Base URL of the weather archives and checksums")
+    subparser.add_argument("--downloads", type=int, default=4, help="Number of archives downloaded at once")
+    subparser.add_argument("--segments", type=int, default=4, help="Number of parallel byte ranges per archive")
+    subparser.add_argument("--verify", action="store_true", help="Rehash pre-downloaded archives instead of trusting the checksum cache")
+    subparser.add_argument("--extract_threads", type=int, default=8, help="Number of threads extracting each archive")
+    subparser.add_argument("--stream", action="store_true", help="Read fog transmittance and rain diff images straight from the downloaded archives instead of extracting them")
+
+
+def add_instrumentation_arguments(subparser):
+    subparser.add_argument("--metrics_json", type=str, help="Write a JSON summary of the time spent per stage to this file")
+    subparser.add_argument("--metrics_prom", type=str, help="Write the time spent per stage to this file, in Prometheus text format")
+    subparser.add_argument("--profile", type=str, help="Profile the main process with cProfile and dump the stats to this file")
+
+
+def dataset_options(args):
+    # Keyword arguments forwarded to the Kitti/Cityscapes constructors
+    kwargs = {"workers": args.workers, "wrap_diff": args.wrap_diff, "force": args.force, "metrics": args.metrics,
+              "output_format": args.format, "png_compression": args.png_compression, "writer_threads": args.writer_threads,
+              "shards": args.shards, "batch_size": args.batch_size, "store_originals": args.store_originals,
+              "persist_index": args.persist_index}
+    if args.download:
+        kwargs.update({"http_path": args.http_path, "max_downloads": args.downloads, "segments": args.segments,
+                       "verify": args.verify, "extract_threads": args.extract_threads})
+    return kwargs
+
+
+def parse(download=False):
+    # download: add the download options, for weather_download-generate.py
     parser = ArgumentParser()
     subparsers = parser.add_subparsers(dest="dataset")
     subparsers.required = True
@@ -25,12 +69,20 @@ def parse():
     all_subparser.add_argument("--kitti_root", type=str, help="Original Kitti path", required=True)
     all_subparser.add_argument("--output_dir", type=str, default=os.path.join(file_dir, "../"))
     all_subparser.add_argument("--weather", nargs='+', choices=['rain', 'fog'], default=['rain', 'fog'])
+    add_generation_arguments(all_subparser)
+    if download:
+        add_download_arguments(all_subparser)
+    add_instrumentation_arguments(all_subparser)
 
     # Cityscapes
     cityscapes_subparser = subparsers.add_parser('cityscapes', help='Actions for Cityscapes')
     cityscapes_subparser.add_argument("--cityscapes_root", type=str, help="Original cityscapes path", required=True)
     cityscapes_subparser.add_argument("--output_dir", type=str, default=os.path.join(file_dir, "../"))
     cityscapes_subparser.add_argument("--weather", nargs='+', choices=['rain', 'fog'], default=['rain', 'fog'])
+    add_generation_arguments(cityscapes_subparser)
+    if download:
+        add_download_arguments(cityscapes_subparser)
+    add_instrumentation_arguments(cityscapes_subparser)
     cityscapes_subparser.add_argument("--sequence", nargs='+', choices=Cityscapes.sequences, default=Cityscapes.sequences)
 
     # Kitti
@@ -38,7 +90,15 @@ def parse():
     kitti_subparser.add_argument("--kitti_root", type=str, help="Original Kitti path", required=True)
     kitti_subparser.add_argument("--output_dir", type=str, default=os.path.join(file_dir, "../"))
     kitti_subparser.add_argument("--weather", nargs='+', choices=['rain', 'fog'], default=['rain', 'fog'])
+    add_generation_arguments(kitti_subparser)
+    if download:
+        add_download_arguments(kitti_subparser)
+    add_instrumentation_arguments(kitti_subparser)
     kitti_subparser.add_argument("--sequence", nargs='+', choices=Kitti.sequences, default=Kitti.sequences)
 
 
-    return parser.parse_args()
+    args = parser.parse_args()
+    args.download = download
+    # Shared by all the datasets of the run
+    args.metrics = Metrics() if args.metrics_json or args.metrics_prom else None
+    return args
@@ -0,0 +1,141 @@
+######################################################################################################################
+# Packed shards of generated images, for data loaders. A shard directory holds the images of one
+# (sequence, weather, level), e.g. fog/30m.shards or rain/25mm.shards, under the same relative paths as the
+# directory layout (rain shards hold both rainy_image/... and rain_mask/...).
+# Export back to the directory layout:
+#       python shards.py %SHARD_DIR% %OUTPUT_DIR%
+######################################################################################################################
+# Halder, S. S., Lalonde, J. F., & de Charette, R. (2019).
+# Physics-Based Rendering for Improving Robustness to Rain. IEEE/CVF International Conference on Computer Vision
+#
+# From: Computer Vision Group, RITS team, Inria
+# License: MIT
+######################################################################################################################
+
+import os
+import glob
+import json
+import time
+import threading
+from argparse import ArgumentParser
+
+import numpy as np
+import cv2
+from tqdm import tqdm
+
+SUFFIX = ".shards"
+
+
+def split(output_file):
+    # <level>.shards/<relative path> -> (shard directory, relative path)
+    shard_directory, relative_path = output_file.split(SUFFIX + os.sep, 1)
+    return shard_directory + SUFFIX, relative_path.replace(os.sep, "/")
+
+
+class ShardWriter:
+    """Appends images to shard parts: a raw uint8 file <part>.bin and its index <part>.jsonl of offsets, shapes
+    and relative paths.
+
+    Each process appends to its own part of every shard directory, so workers never share a file. Parts are named
+    after their creation time and an index line is only written once its data is, the last line of a path wins.
+    """
+
+    def __init__(self):
+        self._parts = {}
+        self._lock = threading.Lock()
+
+    def _part(self, shard_directory):
+        part = self._parts.get(shard_directory)
+        if part is None:
+            os.makedirs(shard_directory, exist_ok=True)
+            name = os.path.join(shard_directory, "part-{:020d}-{}".format(time.time_ns(), os.getpid()))
+            part = self._parts[shard_directory] = [open(name + ".bin", "ab"), open(name + ".jsonl", "a"), 0]
+        return part
+
+    def part_file(self, output_file):
+        with self._lock:
+            return self._part(split(output_file)[0])[0].name
+
+    def write(self, output_file, img):
+        if img.dtype != np.uint8:
+            raise TypeError("Shards only hold uint8 images, got {} for {}".format(img.dtype, output_file))
+        img = np.ascontiguousarray(img)
+        shard_directory, relative_path = split(output_file)
+        with self._lock:
+            part = self._part(shard_directory)
+            data, index, offset = part
+            data.write(img.data)
+            data.flush()
+            index.write(json.dumps({"path": relative_path, "offset": offset, "shape": list(img.shape)}) + "\n")
+            index.flush()
+            part[2] = offset + img.nbytes
+        return img.nbytes
+
+    def close(self):
+        with self._lock:
+            for data, index, _ in self._parts.values():
+                data.close()
+                index.close()
+            self._parts = {}
+
+
+class ShardReader:
+    """Memory maps the parts of a shard directory, images are read-only views indexed by position or relative path."""
+
+    def __init__(self, shard_directory):
+        self.directory = shard_directory
+        self._maps = []
+        self._entries = {}  # relative path -> (part, offset, shape)
+
+        for index_file in sorted(glob.glob(os.path.join(shard_directory, "part-*.jsonl"))):
+            data_file = index_file[:-len(".jsonl")] + ".bin"
+            size = os.path.getsize(data_file) if os.path.isfile(data_file) else 0
+            if size == 0:
+                continue
+            part = len(self._maps)
+            self._maps.append(np.memmap(data_file, dtype=np.uint8, mode="r"))
+            with open(index_file) as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue  # Line truncated by an interrupted run
+                    shape = tuple(entry["shape"])
+                    if entry["offset"] + int(np.prod(shape)) <= size:
+                        self._entries[entry["path"]] = (part, entry["offset"], shape)
+
+        self.paths = sorted(self._entries)
+
+    def __len__(self):
+        return len(self.paths)
+
+    def __contains__(self, relative_path):
+        return relative_path in self._entries
+
+    def __iter__(self):
+        for relative_path in self.paths:
+            yield relative_path, self[relative_path]
+
+    def __getitem__(self, key):
+        part, offset, shape = self._entries[self.paths[key] if isinstance(key, (int, np.integer)) else key]
+        return self._maps[part][offset:offset + int(np.prod(shape))].reshape(shape)
+
+    def export(self, output_directory):
+        # Write every image under output_directory/<relative path>, encoded after its extension
+        for relative_path in tqdm(self.paths, desc="        Export {}".format(self.directory)):
+            output_file = os.path.join(output_directory, *relative_path.split("/"))
+            os.makedirs(os.path.dirname(output_file), exist_ok=True)
+            if output_file.endswith(".npy"):
+                np.save(output_file, self[relative_path])
+            else:
+                cv2.imwrite(output_file, self[relative_path])
+        return len(self.paths)
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument("shard_dir", type=str)
+    parser.add_argument("output_dir", type=str)
+    args = parser.parse_args()
+
+    print("{} images exported".format(ShardReader(args.shard_dir).export(args.output_dir)))
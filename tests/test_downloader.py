@@ -0,0 +1,125 @@
+######################################################################################################################
+# Halder, S. S., Lalonde, J. F., & de Charette, R. (2019).
+# Physics-Based Rendering for Improving Robustness to Rain. IEEE/CVF International Conference on Computer Vision
+#
+# From: Computer Vision Group, RITS team, Inria
+# License: MIT
+######################################################################################################################
+
+import os
+import sys
+import json
+import hashlib
+import threading
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+from downloader import DownloadManager
+from server import Server
+
+SIZE = 1 << 20
+OPTIONS = {"segments": 4, "min_segment_size": 64 << 10, "blocksize": 16 << 10, "retries": 0}
+
+
+class _QuietHandler(SimpleHTTPRequestHandler):
+    # Plain http.server, Range headers are ignored
+    def log_message(self, format, *args):
+        pass
+
+
+class _PlainServer(Server):
+    def __init__(self, directory):
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), partial(_QuietHandler, directory=directory))
+        self.url = "http://127.0.0.1:{}/".format(self.httpd.server_address[1])
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+
+class _InterruptedManager(DownloadManager):
+    # Every segment fails once more than `limit` bytes were received, as if the connection dropped
+    def __init__(self, directory, limit, **kwargs):
+        super().__init__(directory, **kwargs)
+        self.limit = limit
+        self.received = 0
+
+    def _update_progress(self, n=0, total=0):
+        super()._update_progress(n, total)
+        self.received += n
+        if self.received > self.limit:
+            raise ConnectionResetError("Interrupted")
+
+
+@pytest.fixture(scope="module")
+def served(tmp_path_factory):
+    directory = tmp_path_factory.mktemp("served")
+    data = os.urandom(SIZE)
+    with open(os.path.join(directory, "archive.zip"), "wb") as f:
+        f.write(data)
+    return str(directory), hashlib.sha256(data).hexdigest()
+
+
+def _sha256(path):
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def _leftovers(directory):
+    return [name for name in os.listdir(directory) if ".part" in name]
+
+
+def test_segmented_download_resumed(served, tmp_path, capsys):
+    directory, digest = served
+    checksums = {"archive.zip": digest}
+    with Server(directory) as server:
+        url = server.url + "archive.zip"
+        with pytest.raises(OSError):
+            _InterruptedManager(str(tmp_path), SIZE // 4, checksums=checksums, **OPTIONS).download(url)
+
+        # Split in contiguous segments, partially written and saved for the next run
+        with open(os.path.join(tmp_path, "archive.zip.part.json")) as f:
+            segments = json.load(f)["segments"]
+        assert len(segments) == 4
+        assert segments[0][0] == 0 and segments[-1][1] == SIZE
+        assert all(segments[i][1] == segments[i + 1][0] for i in range(3))
+        written = sum(segment[2] for segment in segments)
+        assert 0 < written < SIZE
+
+        path = DownloadManager(str(tmp_path), checksums, **OPTIONS).download(url)
+
+    assert "Resuming: archive.zip" in capsys.readouterr().out
+    assert _sha256(path) == digest
+    assert _leftovers(tmp_path) == []
+
+
+def test_plain_stream_without_ranges(served, tmp_path):
+    directory, digest = served
+    with _PlainServer(directory) as server:
+        path = DownloadManager(str(tmp_path), {"archive.zip": digest}, **OPTIONS).download(server.url + "archive.zip")
+    assert _sha256(path) == digest
+    assert _leftovers(tmp_path) == []
+
+
+def test_corrupted_file_downloaded_again(served, tmp_path, capsys):
+    directory, digest = served
+    with open(os.path.join(tmp_path, "archive.zip"), "wb") as f:
+        f.write(b"corrupted")
+    with Server(directory) as server:
+        path = DownloadManager(str(tmp_path), {"archive.zip": digest}, **OPTIONS).download(server.url + "archive.zip")
+    assert "Sha256sum is invalid: archive.zip" in capsys.readouterr().out
+    assert _sha256(path) == digest
+    assert _leftovers(tmp_path) == []
+
+
+@pytest.mark.parametrize("server_class", [Server, _PlainServer])
+def test_wrong_checksum_raises(served, tmp_path, capsys, server_class):
+    directory, _ = served
+    with server_class(directory) as server:
+        with pytest.raises(IOError):
+            DownloadManager(str(tmp_path), {"archive.zip": "0" * 64}, **OPTIONS).download(server.url + "archive.zip")
+    # Downloaded once more after the first mismatch, then given up
+    assert capsys.readouterr().out.count("Sha256sum is invalid after download") == 2
+    assert os.listdir(tmp_path) == []
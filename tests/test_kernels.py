@@ -0,0 +1,113 @@
+######################################################################################################################
+# Halder, S. S., Lalonde, J. F., & de Charette, R. (2019).
+# Physics-Based Rendering for Improving Robustness to Rain. IEEE/CVF International Conference on Computer Vision
+#
+# From: Computer Vision Group, RITS team, Inria
+# License: MIT
+######################################################################################################################
+
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from kernels import FogKernel, DiffKernel, fog_reference, diff_reference
+
+FRAMES = {"kitti": (352, 1216), "cityscapes": (512, 1024)}
+
+
+def _random(shape, dtype=np.uint8, high=256, seed=0):
+    return np.random.default_rng(seed).integers(0, high, shape).astype(dtype)
+
+
+def _saturated(clear_image, diff_image):
+    return np.clip(clear_image.astype(np.int32) + diff_image.astype(np.int32) - 255, 0, 255).astype(np.uint8)
+
+
+def test_fog_all_pairs():
+    # Every (clear pixel, transmittance) pair, including the truncation to uint8
+    clear, transmittance = np.meshgrid(np.arange(256, dtype=np.uint8), np.arange(256, dtype=np.uint8), indexing="ij")
+    img_clear = np.repeat(clear[..., None], 3, axis=2)
+    fog_transmittance = np.repeat(transmittance[..., None], 3, axis=2)
+    np.testing.assert_array_equal(FogKernel()(img_clear, fog_transmittance), fog_reference(img_clear, fog_transmittance))
+
+
+@pytest.mark.parametrize("linf", [0, 127, 200, 255])
+def test_fog_all_pairs_linf(linf):
+    clear, transmittance = np.meshgrid(np.arange(256, dtype=np.uint8), np.arange(256, dtype=np.uint8), indexing="ij")
+    img_clear = np.repeat(clear[..., None], 3, axis=2)
+    fog_transmittance = np.repeat(transmittance[..., None], 3, axis=2)
+    np.testing.assert_array_equal(FogKernel(linf)(img_clear, fog_transmittance), fog_reference(img_clear, fog_transmittance, linf))
+
+
+@pytest.mark.parametrize("frame", sorted(FRAMES))
+def test_fog_frame_3_channels(frame):
+    img_clear = _random(FRAMES[frame] + (3,), seed=1)
+    fog_transmittance = _random(FRAMES[frame] + (3,), seed=2)
+    np.testing.assert_array_equal(FogKernel()(img_clear, fog_transmittance), fog_reference(img_clear, fog_transmittance))
+
+
+@pytest.mark.parametrize("frame", sorted(FRAMES))
+def test_fog_frame_2d_transmittance(frame):
+    img_clear = _random(FRAMES[frame] + (3,), seed=3)
+    fog_transmittance = _random(FRAMES[frame], seed=4)
+    np.testing.assert_array_equal(FogKernel()(img_clear, fog_transmittance), fog_reference(img_clear, fog_transmittance[..., None]))
+
+
+def test_fog_uint16_fallback():
+    img_clear = _random(FRAMES["kitti"] + (3,), seed=5)
+    fog_transmittance = _random(FRAMES["kitti"] + (3,), np.uint16, seed=6)
+    np.testing.assert_array_equal(FogKernel()(img_clear, fog_transmittance), fog_reference(img_clear, fog_transmittance))
+
+
+def test_fog_reused_buffers_and_out():
+    kernel = FogKernel()
+    img_clear = _random(FRAMES["cityscapes"] + (3,), seed=7)
+    fog_transmittance = _random(FRAMES["cityscapes"] + (3,), seed=8)
+    expected = fog_reference(img_clear, fog_transmittance)
+    kernel(_random(FRAMES["kitti"] + (3,)), _random(FRAMES["kitti"] + (3,)))  # Other shape first
+    np.testing.assert_array_equal(kernel(img_clear, fog_transmittance), expected)
+    out = np.empty_like(img_clear)
+    kernel(img_clear, fog_transmittance, out=out)
+    np.testing.assert_array_equal(out, expected)
+
+
+def test_diff_wrap_all_pairs():
+    # Every (clear pixel, diff) pair of the 16 bits diffs, offset by 255
+    clear, diff = np.meshgrid(np.arange(256, dtype=np.uint16), np.arange(511, dtype=np.uint16), indexing="ij")
+    clear_image = np.repeat(clear[..., None], 3, axis=2).astype(np.uint8)
+    diff_image = np.repeat(diff[..., None], 3, axis=2)
+    np.testing.assert_array_equal(DiffKernel(wrap=True)(clear_image, diff_image), diff_reference(clear_image, diff_image))
+
+
+@pytest.mark.parametrize("frame", sorted(FRAMES))
+def test_diff_wrap_frame(frame):
+    clear_image = _random(FRAMES[frame] + (3,), seed=9)
+    diff_image = _random(FRAMES[frame] + (3,), np.uint16, 511, seed=10)
+    np.testing.assert_array_equal(DiffKernel(wrap=True)(clear_image, diff_image), diff_reference(clear_image, diff_image))
+
+
+def test_diff_saturate_all_pairs():
+    clear, diff = np.meshgrid(np.arange(256, dtype=np.uint16), np.arange(511, dtype=np.uint16), indexing="ij")
+    clear_image = np.repeat(clear[..., None], 3, axis=2).astype(np.uint8)
+    diff_image = np.repeat(diff[..., None], 3, axis=2)
+    augmented_image = DiffKernel()(clear_image, diff_image)
+    np.testing.assert_array_equal(augmented_image, _saturated(clear_image, diff_image))
+    # Bounds: a full negative diff gives black, a full positive diff gives white
+    assert (augmented_image[:, 0] == 0).all() and (augmented_image[:, 510] == 255).all()
+
+
+@pytest.mark.parametrize("frame", sorted(FRAMES))
+def test_diff_saturate_frame(frame):
+    clear_image = _random(FRAMES[frame] + (3,), seed=11)
+    diff_image = _random(FRAMES[frame] + (3,), np.uint16, 511, seed=12)
+    np.testing.assert_array_equal(DiffKernel()(clear_image, diff_image), _saturated(clear_image, diff_image))
+
+
+def test_diff_saturate_uint8_diff():
+    # 8 bits diffs can only darken the image
+    clear_image = _random(FRAMES["kitti"] + (3,), seed=13)
+    diff_image = _random(FRAMES["kitti"] + (3,), seed=14)
+    np.testing.assert_array_equal(DiffKernel()(clear_image, diff_image), _saturated(clear_image, diff_image))
@@ -20,30 +20,28 @@
 ######################################################################################################################
 
 import options
+import instrumentation
 from kitti import Kitti
 from cityscapes import Cityscapes
 
 
 def main(args):
     if args.dataset == "cityscapes":
-        dataset_list = [Cityscapes(args.cityscapes_root, args.output_dir, args.sequence)]
+        dataset_list = [Cityscapes(args.cityscapes_root, args.output_dir, args.sequence, **options.dataset_options(args))]
     elif args.dataset == "kitti":
-        dataset_list = [Kitti(args.kitti_root, args.output_dir, args.sequence)]
+        dataset_list = [Kitti(args.kitti_root, args.output_dir, args.sequence, **options.dataset_options(args))]
     else:
-        dataset_list = [Cityscapes(args.cityscapes_root, args.output_dir),
-                        Kitti(args.kitti_root, args.output_dir)]
+        dataset_list = [Cityscapes(args.cityscapes_root, args.output_dir, **options.dataset_options(args)),
+                        Kitti(args.kitti_root, args.output_dir, **options.dataset_options(args))]
 
     for i, dataset in enumerate(dataset_list):
         print("Dataset {} [{}/{}]".format(dataset.name, i+1, len(dataset_list)))
 
-        if 'rain' in args.weather:
-            print(" {}, Rain".format(dataset.name))
-            dataset.generate_rain()
-
-        if 'fog' in args.weather:
-            print(" {}, Fog".format(dataset.name))
-            dataset.generate_fog()
+        print(" {}, {}".format(dataset.name, ", ".join(weather.capitalize() for weather in args.weather)))
+        dataset.generate(args.weather)
 
 
 if __name__ == '__main__':
-    main(options.parse())
+    args = options.parse()
+    with instrumentation.session(args.metrics, args.profile, args.metrics_json, args.metrics_prom):
+        main(args)
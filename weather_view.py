@@ -0,0 +1,161 @@
+######################################################################################################################
+# Halder, S. S., Lalonde, J. F., & de Charette, R. (2019).
+# Physics-Based Rendering for Improving Robustness to Rain. IEEE/CVF International Conference on Computer Vision
+#
+# From: Computer Vision Group, RITS team, Inria
+# License: MIT
+######################################################################################################################
+
+import os
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from zipfile import ZipFile
+
+import numpy as np
+import cv2
+
+from kernels import FogKernel, DiffKernel
+
+
+class WeatherView:
+    """Foggy or rainy frames of a dataset at one level, composited in memory when accessed.
+
+    Frames are built from the original images and the extracted (or streamed, with `archives`) fog transmittance
+    or rain diff images, so nothing needs to be generated beforehand. Datasets shipping rendered rainy images
+    (Kitti) return them as they are. Indexing returns a new HxWx3 uint8 array, `batch` stacks several frames into
+    one NxHxWx3 array, and iterating with `prefetch` > 0 computes the next frames on background threads.
+    Transformed originals are kept in the LRU cache of the dataset (`cache_size`), shared by all its views, so
+    sampling the same frame at several levels decodes it once.
+
+    Example:
+        view = WeatherView(Kitti(kitti_root, output_dir), "fog", "30m", prefetch=4)
+        for frames in view.batches(16):
+            ...
+    """
+
+    def __init__(self, dataset, weather, level, sequences=None, archives=None, prefetch=0):
+        if weather not in ("fog", "rain"):
+            raise ValueError("Unknown weather: {}".format(weather))
+        self.dataset = dataset
+        self.weather = weather
+        self.level = level
+        self.prefetch = prefetch
+        self.composited = weather == "fog" or dataset._rain_from_diff()
+        self._local = threading.local()  # Kernels and archive handles of each thread
+
+        if weather == "fog":
+            data, prefix = "fog_transmittance", level + "/"
+        else:
+            data, prefix = "rain_diff" if self.composited else "rain", level + "/rainy_image/"
+
+        self.samples = []  # (sequence, relative path, weather source, rain mask source)
+        levels = set()
+        for sequence in sequences or dataset.sequences:
+            sources = dataset._sources(sequence, data, archives)
+            levels.update(path.split("/", 1)[0] for path in sources)
+            for path in sorted(sources):
+                if path.startswith(prefix):
+                    relative_path = path[len(prefix):]
+                    if self.composited and not dataset._file_index.contains(os.path.join(dataset.original_dir, sequence), relative_path):
+                        print("File {} doesn't exist".format(os.path.join(dataset.original_dir, sequence, relative_path)))
+                        continue
+                    mask = sources.get("/".join([level, "rain_mask", relative_path]))
+                    self.samples.append((sequence, relative_path, sources[path], mask))
+
+        if not self.samples:
+            raise ValueError("No {} data for level {} in {}, available levels: {}".format(weather, level, dataset.name, sorted(levels)))
+
+    def __len__(self):
+        return len(self.samples)
+
+    def __getitem__(self, index):
+        return self._frame(self.samples[index])
+
+    def __iter__(self):
+        return self._prefetched(self.__getitem__, range(len(self)))
+
+    def cache_info(self):
+        # Hits and misses of the originals cache, shared by the views of the dataset
+        cache = self.dataset._originals_cache
+        return {"hits": cache.hits, "misses": cache.misses, "size": len(cache), "maxsize": cache.maxsize}
+
+    def path(self, index):
+        # Path of the frame relative to its sequence, as in the generated dataset
+        sequence, relative_path, _, _ = self.samples[index]
+        return os.path.join(sequence, relative_path)
+
+    def mask(self, index):
+        # Rain mask of the frame, None for fog
+        mask = self.samples[index][3]
+        return self._read(mask) if mask is not None else None
+
+    def batch(self, indices):
+        # Frames stacked in a single array, they must all have the same shape
+        indices = list(indices)
+        first = self[indices[0]]
+        batch = np.empty((len(indices),) + first.shape, dtype=first.dtype)
+        batch[0] = first
+        for i, index in enumerate(indices[1:], 1):
+            out = batch[i]
+            frame = self._frame(self.samples[index], out)
+            if frame.shape != first.shape:
+                raise ValueError("Frame {} has shape {}, expected {}".format(self.path(index), frame.shape, first.shape))
+            if not np.may_share_memory(frame, out):
+                out[...] = frame
+        return batch
+
+    def batches(self, batch_size):
+        starts = range(0, len(self), batch_size)
+        return self._prefetched(self.batch, [range(start, min(start + batch_size, len(self))) for start in starts])
+
+    def _prefetched(self, func, args):
+        # Yield func(arg) in order, computing up to `prefetch` results ahead on background threads
+        if self.prefetch <= 0:
+            for arg in args:
+                yield func(arg)
+            return
+
+        with ThreadPoolExecutor(max_workers=self.prefetch) as executor:
+            pending = deque()
+            for arg in args:
+                pending.append(executor.submit(func, arg))
+                if len(pending) > self.prefetch:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+
+    def _thread(self):
+        # Kernels reuse internal buffers and archive handles can't be shared, each thread has its own
+        local = self._local
+        if not hasattr(local, "archives"):
+            local.fog_kernel = FogKernel(self.dataset._fog_kernel.linf)
+            local.diff_kernel = DiffKernel(wrap=self.dataset._diff_kernel.wrap)
+            local.archives = {}
+        return local
+
+    def _read(self, source, flags=cv2.IMREAD_UNCHANGED):
+        if isinstance(source, str):
+            img = cv2.imread(source, flags)
+            if img is None:
+                raise FileNotFoundError("Can't read {}".format(source))
+            return img
+        archives = self._thread().archives
+        archive, member = source
+        if archive not in archives:
+            archives[archive] = ZipFile(archive)
+        return cv2.imdecode(np.frombuffer(archives[archive].read(member), dtype=np.uint8), flags)
+
+    def _frame(self, sample, out=None):
+        # Composite the frame, into `out` if it has the right shape
+        sequence, relative_path, source, _ = sample
+        weather_image = self._read(source)
+        if not self.composited:
+            return weather_image
+
+        img_clear = self.dataset._originals_cache.get(os.path.join(self.dataset.original_dir, sequence, relative_path), self.dataset._load_original)
+        if out is None or out.shape != img_clear.shape:
+            out = np.empty_like(img_clear)
+        local = self._thread()
+        kernel = local.fog_kernel if self.weather == "fog" else local.diff_kernel
+        return kernel(img_clear, weather_image, out=out)